@@ -0,0 +1,115 @@
+import time
+import asyncio
+import threading
+from logger import log
+
+# Seconds of saturated work each tuning step is judged on.
+TUNE_INTERVAL = 2.0
+# A step counts as an improvement only if throughput rose by more than this share; smaller changes are within the noise of a window.
+MIN_GAIN = 0.1
+# After this many turns without a gain the tuner stops on the best level it measured.
+MAX_REVERSALS = 2
+
+class AdjustableLimit:
+    """A concurrency cap that can be raised or lowered while work is running.
+
+    Lowering it never interrupts anything: active holders finish and newcomers wait until they
+    are below the new limit. `waiting` tells whether there is more work than the limit admits.
+    """
+    def __init__(self, limit):
+        self.condition = threading.Condition()
+        self.limit, self.active, self.waiting = limit, 0, 0
+
+    def set(self, limit):
+        with self.condition:
+            self.limit = limit
+            self.condition.notify_all()
+
+    def try_acquire(self):
+        with self.condition:
+            if self.active >= self.limit: return False
+            self.active += 1
+            return True
+
+    def acquire(self):
+        with self.condition:
+            self.waiting += 1
+            while self.active >= self.limit: self.condition.wait()
+            self.waiting -= 1
+            self.active += 1
+
+    async def acquire_async(self):
+        # Polls like ConnectionLimiter, so a waiting coroutine never blocks the event loop thread.
+        with self.condition: self.waiting += 1
+        try:
+            while not self.try_acquire(): await asyncio.sleep(0.01)
+        finally:
+            with self.condition: self.waiting -= 1
+
+    def release(self):
+        with self.condition:
+            self.active -= 1
+            self.condition.notify()
+
+    def saturated(self):
+        with self.condition: return self.waiting > 0
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+class ConcurrencyTuner:
+    """Hill-climbs one worker count on the throughput it achieves.
+
+    `sample()` returns cumulative (amount, errors), e.g. bytes hashed and failed requests.
+    Each tick() judges the window since the last one: throughput still rising keeps moving the
+    same way, no gain turns around from the best level, and errors rising always steps down.
+    Windows in which the limit was not the bottleneck (nothing waiting for a slot) are skipped.
+    """
+    def __init__(self, name, limit, minimum, maximum, sample, on_change=None):
+        self.name, self.limit, self.minimum, self.maximum = name, limit, minimum, maximum
+        self.sample, self.on_change = sample, on_change
+        self.level = limit.limit
+        self.direction, self.reversals, self.settled = 1, 0, False
+        self.last_rate, self.last_errors = None, 0
+        self.best_level, self.best_rate = self.level, 0.0
+        self.measured = False
+        self.mark = (time.monotonic(),) + tuple(sample())
+
+    def tick(self):
+        if self.settled: return
+        now, (amount, errors) = time.monotonic(), self.sample()
+        started, last_amount, last_errors = self.mark
+        self.mark = (now, amount, errors)
+        if not self.limit.saturated() or amount == last_amount: return
+        rate, new_errors = (amount - last_amount) / max(now - started, 1e-3), errors - last_errors
+        self.measured = True
+        if rate > self.best_rate and new_errors <= self.last_errors: self.best_level, self.best_rate = self.level, rate
+        if new_errors > self.last_errors:
+            self.direction, target = -1, self.level - self.step()
+        elif self.last_rate is None or rate > self.last_rate * (1 + MIN_GAIN):
+            target = self.level + self.direction * self.step()
+        else:
+            self.reversals += 1
+            self.direction = -self.direction
+            target = self.best_level + self.direction * self.step()
+        self.last_rate, self.last_errors = rate, new_errors
+        target = min(max(target, self.minimum), self.maximum)
+        if self.reversals > MAX_REVERSALS or target == self.level:
+            self.settled, target = True, self.best_level
+            log.info(f"Auto-tune settled {self.name} at {target} (throughput {self.best_rate / (1024 * 1024):.1f}M/s).")
+        else:
+            log.debug(f"Auto-tune moves {self.name} from {self.level} to {target} (throughput {rate / (1024 * 1024):.1f}M/s, {new_errors} errors).")
+        self.set_level(target)
+
+    def step(self):
+        return max(1, self.level // 4)
+
+    def set_level(self, level):
+        if level == self.level: return
+        self.level = level
+        self.limit.set(level)
+        if self.on_change: self.on_change(level)
@@ -0,0 +1,210 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import threading
+import statistics
+from datetime import datetime, timezone
+from gitea_standin import SHAPES, StandinServer, generate_tree
+from hash_store import HashStore, HASH_STORE_FILE, store_root
+from http_client import close_sessions
+from soundpack_manager import SoundpackManager, get_remote_tree_fast
+from logger import log
+
+REPO_NAME = 'bench/pack'
+RESULTS_FILE = 'benchmark_results.json'
+DEFAULT_TOLERANCE = 0.15
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Benchmark tree listing, scanning, hashing, comparing and downloading against a local Gitea stand-in.")
+    parser.add_argument('--shape', choices=sorted(SHAPES), default='scripts', help="Synthetic repository layout (default: %(default)s).")
+    parser.add_argument('--files', type=int, help="Override the shape's file count.")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--data-dir', default=os.path.join(tempfile.gettempdir(), 'soundpack_bench'),
+                        help="Where generated repositories are kept between runs (default: %(default)s).")
+    parser.add_argument('--latency', type=float, default=0.0, help="Seconds the server adds to every request.")
+    parser.add_argument('--bandwidth', type=float, help="Server uplink limit in bytes per second.")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Fraction of requests the server fails.")
+    parser.add_argument('--scan-workers', type=int, default=4)
+    parser.add_argument('--download-workers', type=int, default=8)
+    parser.add_argument('--engine', choices=('threads', 'asyncio'), default='threads')
+    parser.add_argument('--auto-tune', action='store_true', help="Let end-to-end runs tune the worker counts, starting from the ones given.")
+    parser.add_argument('--archive-threshold', type=float, help="Share of changed files that switches to an archive install (0 = never; default: the updater's).")
+    parser.add_argument('--archive-cut', type=int, help="Have the server reset archive downloads after this many bytes, so cold runs must fall back to per-file downloads.")
+    parser.add_argument('--repeat', type=int, default=1, help="Run the suite this many times and report the median of each metric.")
+    parser.add_argument('--output', default=RESULTS_FILE, help="Results file to write (default: %(default)s).")
+    parser.add_argument('--baseline', help="Earlier results file to compare against.")
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help="Relative slowdown against the baseline that counts as a regression (default: %(default)s).")
+    return parser.parse_args(argv)
+
+def prepare_dataset(args):
+    # Generating 50k files takes a while, so each shape/size/seed is generated once and reused.
+    spec_files = args.files or SHAPES[args.shape]['files']
+    dataset_dir = os.path.join(args.data_dir, f"{args.shape}-{spec_files}-{args.seed}")
+    repo_dir, marker = os.path.join(dataset_dir, 'repo'), os.path.join(dataset_dir, 'dataset.json')
+    if os.path.exists(marker):
+        with open(marker) as f: return repo_dir, json.load(f)
+    shutil.rmtree(dataset_dir, ignore_errors=True)
+    print(f"Generating {spec_files} '{args.shape}' files in {repo_dir}...", file=sys.stderr, flush=True)
+    files, size = generate_tree(repo_dir, args.shape, spec_files, args.seed)
+    info = {'files': files, 'bytes': size}
+    with open(marker, 'w') as f: json.dump(info, f)
+    return repo_dir, info
+
+def client_config(args, repo_url, client_dir):
+    config = {'name': 'benchmark', 'soundpack_path': client_dir, 'scripts_target_subdir': '', 'sounds_target_subdir': 'sounds', 'exclusions': [],
+              'advanced_settings': {'scan_workers': args.scan_workers, 'download_workers': args.download_workers, 'download_engine': args.engine,
+                                                      'auto_tune': args.auto_tune}}
+    # The sounds shape is served like the real sounds repo: one subfolder of it is installed into a target subdir.
+    if args.archive_threshold is not None: config['advanced_settings']['archive_threshold'] = args.archive_threshold
+    if args.shape == 'sounds': config.update(sounds_repo_url=repo_url, sounds_subfolder='ogg')
+    else: config['scripts_repo_url'] = repo_url
+    return config
+
+def per_second(amount, seconds):
+    return amount / seconds if seconds > 0 else 0.0
+
+def timed(func, *args):
+    started = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - started
+
+class Suite:
+    """One pass over every benchmark, in a scratch folder of its own."""
+    def __init__(self, args, server, work_dir):
+        self.args, self.server, self.work_dir = args, server, work_dir
+        self.repo_url = server.repo_api_url(REPO_NAME)
+        self.client_dir = os.path.join(work_dir, 'client')
+        self.config = client_config(args, self.repo_url, self.client_dir)
+        self.metrics = {}
+
+    def manager(self, hash_store, full_scan=False):
+        return SoundpackManager(self.config, threading.Event(), full_scan=full_scan, hash_store=hash_store)
+
+    def run(self):
+        hash_store = HashStore(os.path.join(self.work_dir, HASH_STORE_FILE))
+        try:
+            self.end_to_end('cold', hash_store)
+            self.end_to_end('noop', hash_store)
+            for component in self.manager(hash_store).get_components(self.client_dir):
+                hash_store.drop_manifest(store_root(component['target_dir']), component['name'])
+            self.end_to_end('warm', hash_store)
+        finally:
+            hash_store.close()
+        self.phases()
+        return self.metrics
+
+    def end_to_end(self, name, hash_store):
+        # cold: empty client folder; warm: files and hash cache present but no manifest, so the tree is fetched and compared; noop: nothing changed.
+        close_sessions()
+        requests_before = self.server.requests
+        manager = self.manager(hash_store)
+        _, seconds = timed(manager.run_update_or_install)
+        phases = manager.progress.summary()
+        scan, hashed, download, archive = (phases.get(p, {}) for p in ('scan', 'hash', 'download', 'archive'))
+        self.metrics.update({
+            f'{name}.total_seconds': seconds,
+            f'{name}.requests': self.server.requests - requests_before,
+            f'{name}.files_scanned': scan.get('files_done', 0),
+            f'{name}.files_hashed': hashed.get('files_done', 0),
+            f'{name}.files_downloaded': download.get('files_done', 0),
+            f'{name}.files_extracted': archive.get('files_done', 0),
+            f'{name}.files_failed': len(manager.failures),
+            f'{name}.errors': len(manager.errors),
+            f'{name}.download_bytes_per_second': per_second(download.get('bytes_done', 0), download.get('active', 0)),
+            f'{name}.archive_bytes_per_second': per_second(archive.get('bytes_done', 0), archive.get('active', 0)),
+        })
+        if manager.errors or manager.failures: log.warning(f"Benchmark run '{name}' had errors: {manager.errors} {manager.failures[:5]}")
+
+    def phases(self):
+        # Each stage on its own, so a change in one is not hidden by the pipelining of a full run.
+        close_sessions()
+        hash_store = HashStore(os.path.join(self.work_dir, 'phases.db'))
+        try:
+            manager = self.manager(hash_store)
+            component = manager.get_components(self.client_dir)[0]
+            target_dir = component['target_dir']
+            expected, seconds = timed(get_remote_tree_fast, self.repo_url, threading.Event(), None, component['subfolder'])
+            if expected is None: raise RuntimeError("Tree listing failed; see log.log.")
+            self.metrics.update({'tree.seconds': seconds, 'tree.entries_per_second': per_second(len(expected), seconds)})
+
+            _, seconds = timed(manager.get_local_file_hashes, target_dir, self.args.scan_workers)
+            hashed = manager.progress.totals('hash')
+            self.metrics.update({'hash.seconds': seconds, 'hash.files_per_second': per_second(hashed['files_done'], seconds),
+                                 'hash.bytes_per_second': per_second(hashed['bytes_done'], seconds)})
+
+            manager = self.manager(hash_store)
+            local_files, seconds = timed(manager.get_local_file_hashes, target_dir, self.args.scan_workers)
+            self.metrics.update({'scan.seconds': seconds, 'scan.files_per_second': per_second(len(local_files), seconds)})
+
+            started = time.perf_counter()
+            stale = [path for path, data in expected.items() if manager.local_sha(local_files, target_dir, path, component['prune']) != data['sha']]
+            seconds = time.perf_counter() - started
+            self.metrics.update({'compare.seconds': seconds, 'compare.entries_per_second': per_second(len(expected), seconds), 'compare.stale': len(stale)})
+
+            download_dir = os.path.join(self.work_dir, 'download')
+            items = [manager.download_item(data['url'], download_dir, path, data['sha'], data.get('size'), component['name']) for path, data in expected.items()]
+            close_sessions()
+            manager = self.manager(hash_store)
+            _, seconds = timed(manager.download_files_in_parallel, items, self.args.download_workers)
+            done = manager.progress.totals('download')
+            self.metrics.update({'download.seconds': seconds, 'download.files_per_second': per_second(done['files_done'], seconds),
+                                 'download.bytes_per_second': per_second(done['bytes_done'], seconds), 'download.failed': len(manager.failures)})
+        finally:
+            hash_store.close()
+
+def lower_is_better(metric):
+    return metric.endswith('seconds') and not metric.endswith('per_second')
+
+def compare_to_baseline(metrics, baseline, tolerance):
+    # Returns the metrics that got worse by more than `tolerance`; counts and other non-timing values are shown but never judged.
+    regressions = []
+    print(f"{'metric':40} {'baseline':>14} {'current':>14} {'change':>8}")
+    for metric in sorted(metrics.keys() & baseline.keys()):
+        old, new = baseline[metric], metrics[metric]
+        change = (new - old) / old if old else 0.0
+        judged = lower_is_better(metric) or metric.endswith('per_second')
+        worse = change > tolerance if lower_is_better(metric) else change < -tolerance
+        flag = '  REGRESSION' if judged and worse else ''
+        if flag: regressions.append(metric)
+        print(f"{metric:40} {old:14.3f} {new:14.3f} {change:+8.1%}{flag}")
+    return regressions
+
+def main(argv=None):
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    repo_dir, dataset = prepare_dataset(args)
+    server = StandinServer({REPO_NAME: repo_dir}, latency=args.latency, bandwidth=args.bandwidth, error_rate=args.error_rate,
+                           archive_cut=args.archive_cut).start()
+    runs = []
+    try:
+        for i in range(max(args.repeat, 1)):
+            work_dir = tempfile.mkdtemp(prefix='soundpack_bench_')
+            print(f"Run {i + 1}/{args.repeat} in {work_dir}...", file=sys.stderr, flush=True)
+            try: runs.append(Suite(args, server, work_dir).run())
+            finally: shutil.rmtree(work_dir, ignore_errors=True)
+    finally:
+        server.shutdown(); server.server_close()
+        close_sessions()
+
+    metrics = {metric: statistics.median(run[metric] for run in runs) for metric in runs[0]}
+    failed = [metric for metric in metrics if metric.endswith(('.files_failed', '.errors', 'download.failed')) and metrics[metric]]
+    if failed: print(f"Runs reported failures: {', '.join(failed)}; see log.log.", file=sys.stderr)
+    params = {k: v for k, v in vars(args).items() if k not in ('output', 'baseline', 'tolerance', 'data_dir')}
+    results = {'created': datetime.now(timezone.utc).isoformat(timespec='seconds'), 'params': params, 'dataset': dataset, 'metrics': metrics}
+    with open(args.output, 'w') as f: json.dump(results, f, indent=2)
+    print(json.dumps(metrics, indent=2))
+
+    if not args.baseline: return 1 if failed else 0
+    with open(args.baseline) as f: baseline = json.load(f)
+    if baseline.get('params') != params or baseline.get('dataset') != dataset:
+        print("Warning: the baseline was recorded with different parameters or data.", file=sys.stderr)
+    regressions = compare_to_baseline(metrics, baseline['metrics'], args.tolerance)
+    if regressions: print(f"{len(regressions)} metrics regressed by more than {args.tolerance:.0%}.", file=sys.stderr)
+    return 1 if regressions or failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
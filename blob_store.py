@@ -0,0 +1,132 @@
+import os
+import sys
+import shutil
+import hashlib
+import argparse
+import threading
+from logger import log
+
+BLOB_STORE_DIR = 'objects'
+HASH_CHUNK_SIZE = 1024 * 1024
+FICLONE = 0x40049409
+
+def git_blob_hasher(size):
+    # The tree API reports git blob ids: sha1 over "blob <size>\0" followed by the content.
+    hasher = hashlib.sha1()
+    hasher.update(b'blob %d\0' % size)
+    return hasher
+
+def calculate_blob_sha1(filepath):
+    try:
+        with open(filepath, 'rb') as f:
+            hasher = git_blob_hasher(os.fstat(f.fileno()).st_size)
+            for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''): hasher.update(chunk)
+        return hasher.hexdigest()
+    except IOError: return None
+
+def hash_file_prefix(f, hasher, length):
+    # Feeds the first `length` bytes of an open file into hasher, e.g. the part of a download staged by an earlier attempt.
+    f.seek(0)
+    while f.tell() < length:
+        chunk = f.read(min(HASH_CHUNK_SIZE, length - f.tell()))
+        if not chunk: break
+        hasher.update(chunk)
+
+def reflink(src, dest):
+    # Copy-on-write clone (btrfs, XFS); raises OSError wherever it is not supported.
+    if not sys.platform.startswith('linux'): raise OSError("reflink is only attempted on Linux")
+    import fcntl
+    with open(src, 'rb') as s, open(dest, 'wb') as d: fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+
+def link_or_copy(src, dest):
+    for method in (reflink, os.link):
+        try: method(src, dest); return method.__name__
+        except OSError:
+            if os.path.exists(dest): os.remove(dest)
+    shutil.copyfile(src, dest)
+    return 'copy'
+
+class BlobStore:
+    """Content-addressed copies of downloaded files, keyed by git blob hash and shared by every client.
+
+    Objects are placed into client folders by reflink or hardlink where the filesystem allows it, so
+    a client editing a hardlinked file in place would change the object too; placement re-verifies
+    the object hash and drops it if it no longer matches.
+    """
+    def __init__(self, path=BLOB_STORE_DIR):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+    def object_path(self, sha):
+        return os.path.join(self.path, sha[:2], sha[2:])
+
+    def has(self, sha):
+        return os.path.isfile(self.object_path(sha))
+
+    def add(self, sha, src_path):
+        obj_path = self.object_path(sha)
+        if os.path.exists(obj_path): return
+        os.makedirs(os.path.dirname(obj_path), exist_ok=True)
+        tmp_path = f"{obj_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            link_or_copy(src_path, tmp_path)
+            os.replace(tmp_path, obj_path)
+        except OSError as e:
+            log.warning(f"Could not add {src_path} to the blob store: {e}")
+            if os.path.exists(tmp_path): os.remove(tmp_path)
+
+    def place(self, sha, dest_path, staging_suffix='.part'):
+        # Returns True if dest_path now holds the blob, False if the store does not have a good copy.
+        obj_path = self.object_path(sha)
+        if not os.path.isfile(obj_path): return False
+        if calculate_blob_sha1(obj_path) != sha:
+            log.warning(f"Blob store object {sha} is corrupt (edited through a hardlink?), discarding it.")
+            os.remove(obj_path); return False
+        tmp_path = dest_path + staging_suffix
+        try:
+            if os.path.exists(tmp_path): os.remove(tmp_path)
+            method = link_or_copy(obj_path, tmp_path)
+            os.replace(tmp_path, dest_path)
+            log.debug(f"Placed {dest_path} from the blob store by {method}.")
+            return True
+        except OSError as e:
+            log.warning(f"Could not place blob {sha} at {dest_path}: {e}")
+            if os.path.exists(tmp_path): os.remove(tmp_path)
+            return False
+
+    def iter_objects(self):
+        for prefix in os.scandir(self.path):
+            if not prefix.is_dir() or len(prefix.name) != 2: continue
+            for entry in os.scandir(prefix.path):
+                if entry.is_file() and not entry.name.endswith('.tmp'): yield prefix.name + entry.name, entry
+
+    def gc(self, referenced, dry_run=False):
+        removed, freed = 0, 0
+        for sha, entry in list(self.iter_objects()):
+            if sha in referenced: continue
+            removed, freed = removed + 1, freed + entry.stat().st_size
+            if not dry_run: os.remove(entry.path)
+        log.info(f"Blob store gc {'would remove' if dry_run else 'removed'} {removed} objects ({freed} bytes).")
+        return removed, freed
+
+def main(argv=None):
+    from hash_store import HashStore
+    parser = argparse.ArgumentParser(description="Maintain the shared soundpack blob store.")
+    commands = parser.add_subparsers(dest='command', required=True)
+    gc_parser = commands.add_parser('gc', help="Delete objects that no client folder references anymore.")
+    gc_parser.add_argument('--dry-run', action='store_true', help="Only report what would be deleted.")
+    args = parser.parse_args(argv)
+
+    if not os.path.isdir(BLOB_STORE_DIR):
+        print("No blob store found."); return 0
+    hash_store = HashStore()
+    try:
+        hash_store.prune_missing_roots()
+        removed, freed = BlobStore().gc(hash_store.referenced_shas(), args.dry_run)
+    finally:
+        hash_store.close()
+    print(f"{'Would remove' if args.dry_run else 'Removed'} {removed} unreferenced objects, {freed / (1024 * 1024):.1f} MiB.")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,360 @@
+import os
+import re
+import sys
+import time
+import argparse
+import threading
+import collections
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, unquote
+import requests
+from blob_store import calculate_blob_sha1, git_blob_hasher
+from http_client import get_session, tracked, VERIFY_SSL
+from local_scanner import PART_SUFFIX
+from soundpack_manager import get_remote_branch, get_remote_tree_fast
+from logger import log
+
+PROXY_CACHE_DIR = 'proxy_cache'
+DEFAULT_PROXY_PORT = 3000
+DEFAULT_CACHE_MB = 4096
+DEFAULT_DOWNLOAD_WORKERS = 8
+# Branch heads move, so they are only reused for this long; trees and blobs are named by their hash and never go stale.
+BRANCH_TTL = 30.0
+SERVE_CHUNK_SIZE = 64 * 1024
+# Cache keys start with a tree or blob hash (SHA-1, or SHA-256 for Gitea's newer repositories); nothing else may name a cache file.
+SHA_PATTERN = re.compile(r'[0-9a-f]{40}(?:[0-9a-f]{24})?')
+
+def is_sha(value):
+    return isinstance(value, str) and SHA_PATTERN.fullmatch(value) is not None
+
+class ProxyCache:
+    """Files named by a content hash, with the least recently used evicted once they outgrow `max_bytes`.
+
+    Recency is kept in file mtimes, which every hit bumps, so it survives a restart.
+    """
+    def __init__(self, path, max_bytes):
+        self.path, self.max_bytes = path, max_bytes
+        self.lock = threading.Lock()
+        self.entries, self.total = collections.OrderedDict(), 0
+        os.makedirs(path, exist_ok=True)
+        found = []
+        for prefix in os.scandir(path):
+            if not prefix.is_dir() or len(prefix.name) != 2: continue
+            for entry in os.scandir(prefix.path):
+                if entry.is_file() and not entry.name.endswith(PART_SUFFIX):
+                    st = entry.stat()
+                    found.append((st.st_mtime, prefix.name + entry.name, st.st_size))
+        for _, key, size in sorted(found): self.entries[key] = size; self.total += size
+        with self.lock: self.evict()
+        log.info(f"Proxy cache at {path} holds {len(self.entries)} files ({self.total / (1024 * 1024):.1f} MiB of {max_bytes / (1024 * 1024):.0f} MiB).")
+
+    def object_path(self, key):
+        return os.path.join(self.path, key[:2], key[2:])
+
+    def get(self, key):
+        # The path of a cached file, marked as just used; None on a miss.
+        with self.lock:
+            if key not in self.entries: return None
+            self.entries.move_to_end(key)
+            path = self.object_path(key)
+        try: os.utime(path)
+        except OSError:
+            self.discard(key)
+            return None
+        return path
+
+    def read(self, key):
+        # The contents of a cached file; None on a miss or if the file vanished since it was listed.
+        path = self.get(key)
+        if path is None: return None
+        try:
+            with open(path, 'rb') as f: return f.read()
+        except OSError:
+            self.discard(key)
+            return None
+
+    def discard(self, key):
+        # Forgets a file that was removed behind the cache's back.
+        with self.lock:
+            if key in self.entries: self.total -= self.entries.pop(key)
+
+    def add(self, key):
+        # Takes over a file already written to object_path(key).
+        size = os.path.getsize(self.object_path(key))
+        with self.lock:
+            self.total += size - self.entries.pop(key, 0)
+            self.entries[key] = size
+            self.evict()
+
+    def store(self, key, data):
+        path = self.object_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + PART_SUFFIX, 'wb') as f: f.write(data)
+        os.replace(path + PART_SUFFIX, path)
+        self.add(key)
+
+    def evict(self):
+        # The newest file always stays, even if it alone is over the limit.
+        while self.total > self.max_bytes and len(self.entries) > 1:
+            key, size = self.entries.popitem(last=False)
+            self.total -= size
+            try: os.remove(self.object_path(key))
+            except OSError as e: log.warning(f"Could not evict {key} from the proxy cache: {e}")
+
+class CachingProxy:
+    """Serves the Gitea endpoints the updater uses from a local cache, filling it from `upstream` on a miss.
+
+    Tree pages are cached by tree hash and raw files by blob hash, so every commit that shares
+    a file shares its cached copy. Raw paths are resolved through the branch head's tree; a
+    missing blob is streamed to the client that asked for it while it is written to the cache,
+    and is only kept once its hash matches the tree.
+    """
+    def __init__(self, upstream, cache_dir=PROXY_CACHE_DIR, max_bytes=DEFAULT_CACHE_MB * 1024 * 1024, download_workers=DEFAULT_DOWNLOAD_WORKERS):
+        self.upstream = upstream.rstrip('/')
+        self.cache = ProxyCache(os.path.join(cache_dir, 'objects'), max_bytes)
+        self.cancellation_event = threading.Event()
+        self.lock, self.key_locks = threading.Lock(), {}
+        self.branches, self.heads = {}, {}
+        self.stats = collections.Counter()
+        get_session(self.upstream, download_workers)
+
+    def key_lock(self, key):
+        # One lock per cache key, so clients asking for the same missing file wait for a single upstream fetch.
+        with self.lock: return self.key_locks.setdefault(key, threading.Lock())
+
+    def release_key(self, key):
+        with self.lock: self.key_locks.pop(key, None)
+
+    def count(self, name):
+        with self.lock: self.stats[name] += 1
+
+    def repo_api_url(self, repo):
+        return f"{self.upstream}/api/v1/repos/{repo}"
+
+    def branches_body(self, repo):
+        # The raw /branches answer, shared by every client asking within BRANCH_TTL.
+        with self.key_lock(f"branches:{repo}"):
+            cached = self.branches.get(repo)
+            if cached and time.monotonic() - cached[0] < BRANCH_TTL: return cached[1], cached[2]
+            r = get_session(self.upstream).get(f"{self.repo_api_url(repo)}/branches", verify=VERIFY_SSL, timeout=15)
+            if r.status_code == 200: self.branches[repo] = (time.monotonic(), r.status_code, r.content)
+            return r.status_code, r.content
+
+    def tree_page(self, repo, tree_sha, query, raw_query):
+        page, per_page = query.get('page', '1'), query.get('per_page', '')
+        if not is_sha(tree_sha) or not page.isdigit() or not (per_page.isdigit() or per_page == ''): return 404, b'{"message": "unknown tree"}'
+        key = f"{tree_sha}.{int(bool(query.get('recursive')))}.{page}.{per_page}.json"
+        body = self.cache.read(key)
+        if body is None:
+            try:
+                with self.key_lock(key):
+                    body = self.cache.read(key)
+                    if body is None:
+                        self.count('tree_misses')
+                        r = get_session(self.upstream).get(f"{self.repo_api_url(repo)}/git/trees/{tree_sha}?{raw_query}", verify=VERIFY_SSL, timeout=20)
+                        if r.status_code == 200: self.cache.store(key, r.content)
+                        return r.status_code, r.content
+            finally:
+                self.release_key(key)
+        self.count('tree_hits')
+        return 200, body
+
+    def head_files(self, repo):
+        """(branch_info, {path: {'sha', 'size', 'url'}}) for the branch head, re-listed only when the head moves."""
+        with self.key_lock(f"head:{repo}"):
+            head = self.heads.get(repo)
+            if head and time.monotonic() - head[0] < BRANCH_TTL: return head[1], head[2]
+            branch_info = get_remote_branch(self.repo_api_url(repo))
+            if branch_info is None: return None, None
+            if head and head[1]['commit'] == branch_info['commit']: files = head[2]
+            else:
+                files = get_remote_tree_fast(branch_info['api_url'], self.cancellation_event, branch_info)
+                if files is None: return None, None
+            self.heads[repo] = (time.monotonic(), branch_info, files)
+            return branch_info, files
+
+    def close(self):
+        self.cancellation_event.set()
+
+class ProxyHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args): log.debug(f"Proxy {self.client_address[0]}: {format % args}")
+
+    def send_body(self, status, body, content_type='application/json', headers=None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in (headers or {}).items(): self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        proxy = self.server.proxy
+        parts = urlsplit(self.path)
+        segments = unquote(parts.path).strip('/').split('/')
+        query = dict(pair.partition('=')[::2] for pair in parts.query.split('&') if pair)
+        try:
+            if segments[:3] == ['api', 'v1', 'repos'] and len(segments) >= 6:
+                return self.handle_api(proxy, '/'.join(segments[3:5]), segments[5:], query, parts.query)
+            if len(segments) >= 6 and segments[2:4] == ['raw', 'branch']:
+                return self.handle_raw(proxy, '/'.join(segments[:2]), segments[4], '/'.join(segments[5:]))
+        except requests.exceptions.RequestException as e:
+            log.error(f"Proxy upstream request for {self.path} failed: {e}")
+            return self.send_body(502, b'{"message": "upstream request failed"}')
+        # Archives are not proxied: the updater then fetches the files one by one, which is what the cache serves.
+        self.send_body(404, b'{"message": "not found"}')
+
+    def handle_api(self, proxy, repo, segments, query, raw_query):
+        if segments == ['branches']:
+            status, body = proxy.branches_body(repo)
+            return self.send_body(status, body)
+        if segments[:2] == ['git', 'trees'] and len(segments) == 3:
+            status, body = proxy.tree_page(repo, segments[2], query, raw_query)
+            return self.send_body(status, body)
+        self.send_body(404, b'{"message": "not found"}')
+
+    def handle_raw(self, proxy, repo, branch, rel_path):
+        branch_info, files = proxy.head_files(repo)
+        if branch_info is None: return self.send_body(502, b'Upstream unavailable', 'text/plain')
+        entry = files.get(rel_path)
+        if branch != branch_info['branch'] or entry is None:
+            # Not on the cached head (another branch, or a file the tree does not list); pass it through untouched.
+            return self.pass_through(f"{proxy.upstream}/{repo}/raw/branch/{branch}/{rel_path}")
+        sha = entry['sha']
+        if not is_sha(sha): return self.send_body(502, b'Upstream listed an invalid blob hash', 'text/plain')
+        path = proxy.cache.get(sha)
+        if path is None:
+            try:
+                # The first client asking for a missing blob is served straight from upstream; others wait here and get the cached copy.
+                with proxy.key_lock(sha):
+                    path = proxy.cache.get(sha)
+                    if path is None: return self.tee_blob(proxy, entry, rel_path)
+            finally:
+                proxy.release_key(sha)
+        proxy.count('blob_hits')
+        try: f = open(path, 'rb')
+        except OSError:
+            # Deleted behind the cache's back; the updater retries and the next request downloads it again.
+            proxy.cache.discard(sha)
+            return self.send_body(502, b'Cached file disappeared', 'text/plain')
+        self.send_file(f)
+
+    def range_start(self):
+        # The offset of an open-ended 'bytes=N-' request, the only kind the updater sends; None without one.
+        range_header = self.headers.get('Range', '')
+        if range_header.startswith('bytes=') and range_header.endswith('-') and range_header[6:-1].isdigit(): return int(range_header[6:-1])
+        return None
+
+    def start_file_response(self, start, size):
+        # Returns False after answering 416 for a range past the end. Without a known size the body runs until the connection closes.
+        if start is not None and size is not None and start >= size:
+            self.send_body(416, b'', headers={'Content-Range': f'bytes */{size}'})
+            return False
+        if start is not None:
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {start}-{size - 1}/{size}')
+        else: self.send_response(200)
+        self.send_header('Content-Type', 'application/octet-stream')
+        if size is not None: self.send_header('Content-Length', str(size - (start or 0)))
+        else:
+            self.send_header('Connection', 'close'); self.close_connection = True
+        self.end_headers()
+        return True
+
+    def send_file(self, f):
+        with f:
+            start = self.range_start()
+            if not self.start_file_response(start, os.fstat(f.fileno()).st_size): return
+            f.seek(start or 0)
+            for chunk in iter(lambda: f.read(SERVE_CHUNK_SIZE), b''): self.wfile.write(chunk)
+
+    def tee_blob(self, proxy, entry, rel_path):
+        # Passes the upstream bytes on as they arrive, so a slow uplink never holds the headers back past the updater's timeout.
+        # The whole blob is always fetched, also for a range request, and enters the cache only once its hash matches.
+        sha, url = entry['sha'], entry['url']
+        proxy.count('blob_misses')
+        dest = proxy.cache.object_path(sha)
+        part_path = dest + PART_SUFFIX
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        with get_session(url).get(url, stream=True, verify=VERIFY_SSL, timeout=30) as r, tracked(r):
+            if r.status_code != 200:
+                log.error(f"Proxy download of {url} failed with status {r.status_code}.")
+                return self.send_body(502, b'Upstream download failed', 'text/plain')
+            size = entry.get('size')
+            if size is None and r.headers.get('Content-Length', '').isdigit(): size = int(r.headers['Content-Length'])
+            # A range cannot be cut out of a body of unknown length; the updater then starts the file over.
+            start = self.range_start() if size is not None else None
+            if not self.start_file_response(start, size): return
+            hasher, received, client_open = (git_blob_hasher(size) if size is not None else None), 0, True
+            try:
+                with open(part_path, 'wb') as f:
+                    for chunk in r.iter_content(chunk_size=SERVE_CHUNK_SIZE):
+                        f.write(chunk)
+                        if hasher: hasher.update(chunk)
+                        skip, received = max((start or 0) - received, 0), received + len(chunk)
+                        if not client_open or skip >= len(chunk): continue
+                        # A client that hangs up does not stop the download; the cached copy serves its retry.
+                        try: self.wfile.write(chunk[skip:])
+                        except OSError: client_open = False
+            except (requests.exceptions.RequestException, OSError) as e:
+                log.error(f"Proxy download of {url} was cut off: {e}")
+                self.close_connection = True
+                if os.path.exists(part_path): os.remove(part_path)
+                return
+        if (hasher.hexdigest() if hasher and received == size else calculate_blob_sha1(part_path)) != sha:
+            log.error(f"Proxy download of {url} does not match the tree, not caching it.")
+            self.close_connection = True
+            os.remove(part_path)
+            return
+        os.replace(part_path, dest)
+        proxy.cache.add(sha)
+        log.info(f"Proxy cached {rel_path} ({sha}).")
+
+    def pass_through(self, url):
+        headers = {'Range': self.headers['Range']} if self.headers.get('Range') else {}
+        with get_session(url).get(url, headers=headers, stream=True, verify=VERIFY_SSL, timeout=30) as r, tracked(r):
+            self.send_response(r.status_code)
+            for key in ('Content-Type', 'Content-Length', 'Content-Range', 'Content-Encoding'):
+                if key in r.headers: self.send_header(key, r.headers[key])
+            if 'Content-Length' not in r.headers:
+                self.send_header('Connection', 'close'); self.close_connection = True
+            self.end_headers()
+            for chunk in r.raw.stream(SERVE_CHUNK_SIZE, decode_content=False): self.wfile.write(chunk)
+
+class ProxyServer(ThreadingHTTPServer):
+    """Caching proxy for other updaters on the LAN: point their repo URLs at http://<this machine>:<port>/api/v1/repos/<owner>/<name>."""
+    daemon_threads = True
+
+    def __init__(self, proxy, host='0.0.0.0', port=DEFAULT_PROXY_PORT):
+        super().__init__((host, port), ProxyHandler)
+        self.proxy = proxy
+
+    def handle_error(self, request, client_address):
+        # Updaters dropping keep-alive connections or cancelling mid-file is normal.
+        if not isinstance(sys.exc_info()[1], ConnectionError): super().handle_error(request, client_address)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve soundpack downloads to other updaters on the LAN from a local cache.")
+    parser.add_argument('upstream', help="The Gitea server to cache, e.g. http://nathantech.net:3000")
+    parser.add_argument('--host', default='0.0.0.0', help="Address to listen on (default: %(default)s).")
+    parser.add_argument('--port', type=int, default=DEFAULT_PROXY_PORT, help="Port to listen on (default: %(default)s).")
+    parser.add_argument('--cache-dir', default=PROXY_CACHE_DIR, help="Where cached trees and files are kept (default: %(default)s).")
+    parser.add_argument('--max-cache-mb', type=int, default=DEFAULT_CACHE_MB, help="Cache size limit in MiB (default: %(default)s).")
+    args = parser.parse_args(argv)
+
+    proxy = CachingProxy(args.upstream, args.cache_dir, args.max_cache_mb * 1024 * 1024)
+    server = ProxyServer(proxy, args.host, args.port)
+    print(f"Caching {proxy.upstream} on port {server.server_address[1]}; point scripts_repo_url/sounds_repo_url at "
+          f"http://<this machine>:{server.server_address[1]}/api/v1/repos/<owner>/<name>.", flush=True)
+    try: server.serve_forever()
+    except KeyboardInterrupt: pass
+    finally:
+        server.server_close()
+        proxy.close()
+        log.info(f"Proxy stopped: {dict(proxy.stats)}")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,38 +1,120 @@
 import json
 import os
+import copy
+import atexit
+import tempfile
+import threading
 from logger import log
 
 # This file remains mostly the same, just adding log messages
 # ... (DEFAULT_CONFIGS is the same as the previous step) ...
 CONFIG_FILE = 'configs.json'
+# Changes arriving within this many seconds of each other are written to disk once.
+WRITE_DELAY = 0.5
 DEFAULT_CONFIGS = {
     # Same as previous step, with corrected base URLs
-    "last_selected_client":"MUSHclient","clients":{"MUSHclient":{"name":"MUSHclient","soundpack_path":"","scripts_repo_url":"http://nathantech.net:3000/api/v1/repos/CosmicRage/Mush-Soundpack","sounds_repo_url":"http://nathantech.net:3000/api/v1/repos/CosmicRage/CosmicRageSounds","scripts_target_subdir":"","sounds_target_subdir":"cosmic rage/worlds/cosmic rage/sounds","sounds_subfolder":"ogg","exclusions":["cosmic rage/worlds/cosmic rage/cosmic rage.mcl"],"advanced_settings":{"scan_workers":4,"download_workers":8,"advanced_enabled":False}},"VIP Mud":{"name":"VIP Mud","soundpack_path":"","scripts_repo_url":"http://nathantech.net:3000/api/v1/repos/CosmicRage/VIPMudCosmicRageScripts","sounds_repo_url":"http://nathantech.net:3000/api/v1/repos/CosmicRage/CosmicRageSounds","scripts_target_subdir":"","sounds_target_subdir":"sounds","sounds_subfolder":"wav","exclusions":["settings.set","gags/"],"advanced_settings":{"scan_workers":4,"download_workers":8,"advanced_enabled":False}}}
+    "last_selected_client":"MUSHclient","clients":{"MUSHclient":{"name":"MUSHclient","soundpack_path":"","scripts_repo_url":"http://nathantech.net:3000/api/v1/repos/CosmicRage/Mush-Soundpack","sounds_repo_url":"http://nathantech.net:3000/api/v1/repos/CosmicRage/CosmicRageSounds","scripts_target_subdir":"","sounds_target_subdir":"cosmic rage/worlds/cosmic rage/sounds","sounds_subfolder":"ogg","exclusions":["cosmic rage/worlds/cosmic rage/cosmic rage.mcl"],"advanced_settings":{"scan_workers":4,"download_workers":8,"advanced_enabled":False,"use_blob_store":False,"download_engine":"threads","async_connections":128,"archive_threshold":0.5,"max_download_kbps":0,"auto_tune":True}},"VIP Mud":{"name":"VIP Mud","soundpack_path":"","scripts_repo_url":"http://nathantech.net:3000/api/v1/repos/CosmicRage/VIPMudCosmicRageScripts","sounds_repo_url":"http://nathantech.net:3000/api/v1/repos/CosmicRage/CosmicRageSounds","scripts_target_subdir":"","sounds_target_subdir":"sounds","sounds_subfolder":"wav","exclusions":["settings.set","gags/"],"advanced_settings":{"scan_workers":4,"download_workers":8,"advanced_enabled":False,"use_blob_store":False,"download_engine":"threads","async_connections":128,"archive_threshold":0.5,"max_download_kbps":0,"auto_tune":True}}}
 }
 
+class ConfigStore:
+    """The in-process copy of one config file.
+
+    Reads are served from memory and the file is only parsed again when its mtime or size
+    changes, i.e. when something outside this process edited it. Saves update memory at once
+    and reach the disk WRITE_DELAY seconds after the last of a burst of changes, through a temp
+    file renamed over the old one, so a crash mid-save never leaves a half-written config.
+    Callers always get and hand over their own copies.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.RLock()
+        self.configs, self.signature = None, None
+        self.dirty, self.timer = False, None
+
+    def file_signature(self):
+        try: st = os.stat(self.path)
+        except FileNotFoundError: return None
+        return st.st_mtime_ns, st.st_size
+
+    def load(self):
+        with self.lock:
+            # Unsaved changes are newer than anything on disk.
+            if not self.dirty:
+                signature = self.file_signature()
+                if signature is None:
+                    log.warning(f"Config file not found. Creating a new one with defaults.")
+                    self.configs, self.dirty = copy.deepcopy(DEFAULT_CONFIGS), True
+                    self.flush()
+                elif signature != self.signature:
+                    log.debug(f"Loading configs from {self.path}")
+                    with open(self.path, 'r') as f: configs = json.load(f)
+                    for name, client in configs.get("clients", {}).items():
+                        if "scripts_target_subdir" not in client:
+                            client["scripts_target_subdir"] = DEFAULT_CONFIGS["clients"].get(name, {}).get("scripts_target_subdir", "")
+                        if "sounds_target_subdir" not in client:
+                            client["sounds_target_subdir"] = DEFAULT_CONFIGS["clients"].get(name, {}).get("sounds_target_subdir", "")
+                        # Settings added since the file was written get their defaults, e.g. auto_tune for older configs.
+                        adv_settings = client.setdefault("advanced_settings", {})
+                        # Worker counts someone set by hand stay in charge: auto_tune is only switched on where advanced settings were never enabled.
+                        if adv_settings.get("advanced_enabled"): adv_settings.setdefault("auto_tune", False)
+                        for key, value in DEFAULT_CONFIGS["clients"].get(name, {}).get("advanced_settings", {}).items():
+                            adv_settings.setdefault(key, value)
+                    self.configs, self.signature = configs, signature
+            return copy.deepcopy(self.configs)
+
+    def save(self, configs):
+        with self.lock:
+            self.configs, self.dirty = copy.deepcopy(configs), True
+            if self.timer: self.timer.cancel()
+            self.timer = threading.Timer(WRITE_DELAY, self.flush)
+            self.timer.daemon = True
+            self.timer.start()
+
+    def flush(self):
+        """Writes pending changes now; called by the write timer and at exit."""
+        with self.lock:
+            if self.timer: self.timer.cancel(); self.timer = None
+            if not self.dirty: return
+            log.debug(f"Saving configs to {self.path}")
+            directory = os.path.dirname(os.path.abspath(self.path))
+            fd, temp_path = tempfile.mkstemp(prefix='.configs-', suffix='.tmp', dir=directory)
+            try:
+                with os.fdopen(fd, 'w') as f:
+                    json.dump(self.configs, f, indent=4)
+                    f.flush(); os.fsync(f.fileno())
+                os.replace(temp_path, self.path)
+            except OSError as e:
+                log.error(f"Could not save configs to {self.path}: {e}")
+                try: os.remove(temp_path)
+                except OSError: pass
+                return
+            self.dirty, self.signature = False, self.file_signature()
+
+_stores, _stores_lock = {}, threading.Lock()
+
+def get_store():
+    # Keyed by path, since the headless CLI points CONFIG_FILE at another file.
+    with _stores_lock:
+        key = os.path.abspath(CONFIG_FILE)
+        if key not in _stores: _stores[key] = ConfigStore(CONFIG_FILE)
+        return _stores[key]
+
+def flush_configs():
+    with _stores_lock: stores = list(_stores.values())
+    for store in stores: store.flush()
+
+atexit.register(flush_configs)
+
 def load_configs():
-    log.debug(f"Attempting to load configs from {CONFIG_FILE}")
-    if not os.path.exists(CONFIG_FILE):
-        log.warning(f"Config file not found. Creating a new one with defaults.")
-        save_configs(DEFAULT_CONFIGS)
-    with open(CONFIG_FILE, 'r') as f:
-        configs = json.load(f)
-        for name, client in configs.get("clients", {}).items():
-            if "scripts_target_subdir" not in client:
-                client["scripts_target_subdir"] = DEFAULT_CONFIGS["clients"][name].get("scripts_target_subdir", "")
-            if "sounds_target_subdir" not in client:
-                client["sounds_target_subdir"] = DEFAULT_CONFIGS["clients"][name].get("sounds_target_subdir", "")
-        return configs
+    return get_store().load()
 
 def save_configs(configs):
-    log.debug(f"Saving configs to {CONFIG_FILE}")
-    with open(CONFIG_FILE, 'w') as f:
-        json.dump(configs, f, indent=4)
+    get_store().save(configs)
 
 def reset_to_defaults():
     log.warning("Resetting config file to factory defaults.")
     save_configs(DEFAULT_CONFIGS)
-    return DEFAULT_CONFIGS
+    return copy.deepcopy(DEFAULT_CONFIGS)
 
 def get_client_config(client_name):
     configs = load_configs()
@@ -43,7 +125,7 @@ def update_config_value(client_name, key, value):
     configs = load_configs()
     if 'clients' not in configs: configs['clients'] = {}
     if client_name not in configs['clients']:
-        configs['clients'][client_name] = DEFAULT_CONFIGS['clients'].get(client_name, {})
+        configs['clients'][client_name] = copy.deepcopy(DEFAULT_CONFIGS['clients'].get(client_name, {}))
     configs['clients'][client_name][key] = value
     save_configs(configs)
 
@@ -0,0 +1,202 @@
+import os
+import asyncio
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from blob_store import git_blob_hasher, calculate_blob_sha1, hash_file_prefix
+from download_scheduler import DownloadScheduler
+from http_client import retry_delay, RETRY_TOTAL, RETRY_STATUSES, VERIFY_SSL
+from local_scanner import PART_SUFFIX
+from logger import log
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+ENGINE_THREADS = 'threads'
+ENGINE_ASYNCIO = 'asyncio'
+DEFAULT_ASYNC_CONNECTIONS = 128
+ASYNC_CHUNK_SIZE = 64 * 1024
+
+def create_download_engine(manager, adv_settings, num_workers):
+    engine = adv_settings.get('download_engine', ENGINE_THREADS)
+    if engine == ENGINE_ASYNCIO:
+        if aiohttp is not None:
+            return AsyncDownloadEngine(manager, adv_settings.get('async_connections', DEFAULT_ASYNC_CONNECTIONS))
+        log.warning("The asyncio download engine needs the 'aiohttp' package, falling back to threads.")
+    return ThreadDownloadEngine(manager, num_workers)
+
+def finish_item(item, run):
+    # Settles the future submit() handed out for `item`, whichever task ended up running it.
+    try: run(item)
+    except Exception as e: item['future'].set_exception(e)
+    else: item['future'].set_result(None)
+
+class ThreadDownloadEngine:
+    """One blocking requests stream per worker thread.
+
+    Each submit() adds one task, but a task runs whichever queued item the scheduler ranks
+    first at the moment a worker frees up, not necessarily the one it was submitted for.
+    """
+    def __init__(self, manager, num_workers):
+        self.manager = manager
+        self.executor = ThreadPoolExecutor(max_workers=num_workers, thread_name_prefix='download')
+        self.scheduler = DownloadScheduler(num_workers)
+        self.futures = []
+
+    def submit(self, item):
+        item['future'] = future = Future()
+        self.scheduler.push(item)
+        self.executor.submit(self._run_next)
+        self.futures.append(future)
+        return future
+
+    def _run_next(self):
+        with self.manager.download_slot():
+            item, is_large = self.scheduler.pop()
+            if item is None: return  # Dropped by cancel().
+            try: finish_item(item, self.manager.download_file)
+            finally: self.scheduler.done(is_large)
+
+    def wait(self):
+        wait(self.futures)
+
+    def cancel(self):
+        # Queued items are dropped; running transfers stop at their next chunk or when abort_transfers() cuts their socket.
+        for item in self.scheduler.clear(): item['future'].cancel()
+
+    def close(self):
+        # After a cancel, a transfer still waiting for its connection finishes in the background instead of holding up the run.
+        self.executor.shutdown(wait=not self.manager.cancellation_event.is_set(), cancel_futures=True)
+
+class RetryableStatus(Exception):
+    def __init__(self, status, retry_after):
+        super().__init__(f"HTTP {status}")
+        self.retry_after = retry_after
+
+class AsyncDownloadEngine:
+    """Runs up to `connections` concurrent streams on a single event loop thread.
+
+    Transfers follow the same .part staging, Range resume and verification rules as the
+    thread engine; the blocking bits (blob store placement, final verify and rename) go to
+    the loop's default executor.
+    """
+    def __init__(self, manager, connections):
+        self.manager, self.connections = manager, connections
+        self.scheduler = DownloadScheduler(connections)
+        self.futures, self.tasks = [], []
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name='async-downloads', daemon=True)
+        self.thread.start()
+        asyncio.run_coroutine_threadsafe(self._open(), self.loop).result()
+
+    async def _open(self):
+        self.semaphore = asyncio.Semaphore(self.connections)
+        connector = aiohttp.TCPConnector(limit=self.connections, ssl=None if VERIFY_SSL else False)
+        self.session = aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=None, sock_connect=15, sock_read=30))
+
+    def submit(self, item):
+        # Same scheme as the thread engine: the coroutine takes the scheduler's pick once it holds a connection.
+        item['future'] = future = Future()
+        self.scheduler.push(item)
+        self.tasks.append(asyncio.run_coroutine_threadsafe(self._run_next(), self.loop))
+        self.futures.append(future)
+        return future
+
+    def wait(self):
+        wait(self.futures)
+
+    def cancel(self):
+        # Unlike a blocked thread, a coroutine can be stopped mid-read, so running transfers are cancelled too.
+        for item in self.scheduler.clear(): item['future'].cancel()
+        for task in self.tasks: task.cancel()
+
+    def close(self):
+        asyncio.run_coroutine_threadsafe(self.session.close(), self.loop).result()
+        asyncio.run_coroutine_threadsafe(self.loop.shutdown_default_executor(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+    async def _run_next(self):
+        async with self.semaphore:
+            limit = self.manager.download_limit
+            if limit: await limit.acquire_async()
+            try:
+                item, is_large = self.scheduler.pop()
+                if item is None: return  # Dropped by cancel().
+                try:
+                    await self._download(item)
+                    item['future'].set_result(None)
+                except asyncio.CancelledError:
+                    item['future'].cancel(); raise
+                except Exception as e: item['future'].set_exception(e)
+                finally: self.scheduler.done(is_large)
+            finally:
+                if limit: limit.release()
+
+    async def _download(self, item):
+        manager = self.manager
+        if manager.cancellation_event.is_set(): return
+        try:
+            if await self.loop.run_in_executor(None, manager.prepare_download, item): return
+            limiter = manager.connection_limiter
+            if limiter: await limiter.acquire_async()
+            try:
+                sha1 = await self._fetch_with_retries(item)
+                if manager.restart_stale_part(item, sha1): sha1 = await self._fetch_with_retries(item)
+            finally:
+                if limiter: limiter.release()
+            if sha1 is None: return  # Cancelled; the .part file is kept so the next run can resume it.
+            await self.loop.run_in_executor(None, manager.finish_download, item, sha1)
+        except Exception as e:
+            manager.record_failure(item, e)
+
+    async def _fetch_with_retries(self, item):
+        url = item['url']
+        for attempt in range(RETRY_TOTAL + 1):
+            try:
+                return await self._fetch_to_part(item)
+            except RetryableStatus as e:
+                error, delay = e, retry_delay(attempt, e.retry_after)
+            except (aiohttp.ClientConnectionError, aiohttp.ClientPayloadError, asyncio.TimeoutError) as e:
+                error, delay = e, retry_delay(attempt)
+            if attempt == RETRY_TOTAL or self.manager.cancellation_event.is_set(): raise error
+            log.warning(f"Transfer of {url} failed ({error!r}), retrying in {delay:.1f}s.")
+            self.manager.metrics.count('retries', component=item.get('component'))
+            await asyncio.sleep(delay)
+
+    async def _fetch_to_part(self, item):
+        url, part_path, size = item['url'], item['dest'] + PART_SUFFIX, item.get('size')
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        if size is not None and offset > size: offset = 0
+        if size is not None and offset == size:
+            self.manager.count_download_bytes(item, size)
+            item['resumed'] = True
+            return await self.loop.run_in_executor(None, calculate_blob_sha1, part_path)
+
+        headers = {'Range': f'bytes={offset}-'} if offset else {}
+        async with self.session.get(url, headers=headers) as r:
+            if r.status in RETRY_STATUSES: raise RetryableStatus(r.status, r.headers.get('Retry-After'))
+            if r.status == 416: os.remove(part_path)
+            r.raise_for_status()
+            if offset and (r.status != 206 or not r.headers.get('Content-Range', '').startswith(f'bytes {offset}-')):
+                log.debug(f"Server ignored the range request for {url}, starting over."); offset = 0
+            item['resumed'] = offset > 0
+            if size is None and r.content_length is not None: size = offset + r.content_length
+            hasher, received = (git_blob_hasher(size) if size is not None else None), offset
+            self.manager.count_download_bytes(item, offset)
+            with open(part_path, 'r+b' if offset else 'wb') as f:
+                if hasher: hash_file_prefix(f, hasher, offset)
+                f.seek(offset); f.truncate()
+                async for chunk in r.content.iter_chunked(ASYNC_CHUNK_SIZE):
+                    if self.manager.cancellation_event.is_set(): return None
+                    if self.manager.bandwidth:
+                        delay = self.manager.bandwidth.reserve(len(chunk))
+                        if delay: await asyncio.sleep(delay)
+                    f.write(chunk)
+                    received += len(chunk)
+                    self.manager.count_download_bytes(item, received)
+                    if hasher: hasher.update(chunk)
+        if hasher and received == size: return hasher.hexdigest()
+        return await self.loop.run_in_executor(None, calculate_blob_sha1, part_path)
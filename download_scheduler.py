@@ -0,0 +1,63 @@
+import heapq
+import itertools
+import threading
+
+# Files from this size up count as large; a share of the workers is kept on them so long transfers start early.
+LARGE_FILE_SIZE = 1024 * 1024
+LARGE_WORKER_SHARE = 0.25
+# Lower runs first. The MUD client cannot start without its scripts, while sounds can trickle in later.
+COMPONENT_PRIORITY = {'scripts': 0}
+DEFAULT_PRIORITY = 1
+
+class DownloadScheduler:
+    """Decides which queued download a free worker takes next.
+
+    Scripts go before every other component. Within a component small files go first, smallest
+    first, so many files land quickly, while up to a quarter of the workers take large files,
+    largest first, so the big transfers overlap the small ones and do not pile up at the end.
+    Engines push every submitted item and pop whenever a worker is free; an item without a size
+    counts as small.
+    """
+    def __init__(self, workers):
+        self.lock = threading.Lock()
+        self.small, self.large = [], []
+        self.order = itertools.count()
+        self.large_active, self.large_slots = 0, max(1, int(workers * LARGE_WORKER_SHARE))
+
+    def resize(self, workers):
+        # Called when auto-tuning changes how many transfers run at once.
+        with self.lock: self.large_slots = max(1, int(workers * LARGE_WORKER_SHARE))
+
+    def __len__(self):
+        with self.lock: return len(self.small) + len(self.large)
+
+    def push(self, item):
+        size, rank = item.get('size') or 0, COMPONENT_PRIORITY.get(item.get('component'), DEFAULT_PRIORITY)
+        with self.lock:
+            if size >= LARGE_FILE_SIZE: heapq.heappush(self.large, (rank, -size, next(self.order), item))
+            else: heapq.heappush(self.small, (rank, size, next(self.order), item))
+
+    def pop(self):
+        """Returns (item, is_large), or (None, False) when nothing is queued. Call done(is_large) once the item finished."""
+        with self.lock:
+            if not self.small and not self.large: return None, False
+            if not self.small: take_large = True
+            elif not self.large: take_large = False
+            else:
+                small_rank, large_rank = self.small[0][0], self.large[0][0]
+                take_large = large_rank < small_rank or (large_rank == small_rank and self.large_active < self.large_slots)
+            if take_large:
+                self.large_active += 1
+                return heapq.heappop(self.large)[-1], True
+            return heapq.heappop(self.small)[-1], False
+
+    def clear(self):
+        """Empties the queue and returns the items that were still waiting."""
+        with self.lock:
+            items = [entry[-1] for entry in self.small + self.large]
+            self.small, self.large = [], []
+        return items
+
+    def done(self, is_large):
+        if is_large:
+            with self.lock: self.large_active -= 1
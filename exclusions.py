@@ -0,0 +1,72 @@
+import re
+
+GLOB_CHARS = frozenset('*?[')
+_DIR, _FILE = '/', ''
+
+def normalize_pattern(pattern):
+    return pattern.strip().replace('\\', '/').lstrip('/')
+
+def glob_to_regex(pattern):
+    # '*' and '?' stay within one path segment; '**' spans any number of them ('a/**/b' also matches 'a/b').
+    out, i = [], 0
+    while i < len(pattern):
+        if pattern.startswith('**/', i): out.append('(?:.*/)?'); i += 3
+        elif pattern.startswith('**', i): out.append('.*'); i += 2
+        elif pattern[i] == '*': out.append('[^/]*'); i += 1
+        elif pattern[i] == '?': out.append('[^/]'); i += 1
+        elif pattern[i] == '[' and ']' in pattern[i + 2:]:
+            end = pattern.index(']', i + 2)
+            body = pattern[i + 1:end]
+            out.append('[' + ('^' + body[1:] if body.startswith('!') else body).replace('\\', '\\\\') + ']'); i = end + 1
+        else: out.append(re.escape(pattern[i])); i += 1
+    return ''.join(out)
+
+class ExclusionMatcher:
+    """A client's exclusion list, compiled once per run.
+
+    Plain entries keep their old meaning: 'folder/' excludes everything below the folder and
+    anything else excludes exactly that path. They live in a trie of path segments, so a lookup
+    costs the depth of the path whatever the number of exclusions. Entries with '*', '?' or '[...]'
+    are globs and are folded into a single regex; a glob matches a path or any of its parent
+    folders (so 'logs/*' excludes everything inside logs), and a glob ending in '/' only matches folders.
+    """
+    def __init__(self, patterns):
+        self.trie = {}
+        any_globs, dir_globs = [], []
+        for pattern in patterns or ():
+            pattern = normalize_pattern(pattern)
+            if not pattern: continue
+            if GLOB_CHARS & set(pattern):
+                (dir_globs if pattern.endswith('/') else any_globs).append(glob_to_regex(pattern.rstrip('/')))
+                continue
+            node = self.trie
+            for segment in pattern.rstrip('/').split('/'): node = node.setdefault(segment, {})
+            node[_DIR if pattern.endswith('/') else _FILE] = True
+        self.any_glob = re.compile('|'.join(f'(?:{p})' for p in any_globs)) if any_globs else None
+        self.dir_glob = re.compile('|'.join(f'(?:{p})' for p in any_globs + dir_globs)) if any_globs or dir_globs else None
+
+    def __bool__(self):
+        return bool(self.trie or self.dir_glob)
+
+    def excludes_dir(self, rel_dir):
+        """True if everything below the relative folder `rel_dir` is excluded."""
+        node, prefix = self.trie, ''
+        for segment in rel_dir.split('/'):
+            prefix = prefix + '/' + segment if prefix else segment
+            if self.dir_glob and self.dir_glob.fullmatch(prefix): return True
+            node = node.get(segment) if node is not None else None
+            if node is not None and _DIR in node: return True
+        return False
+
+    def excludes_file(self, rel_path):
+        """Checks the file itself only, for callers that have already ruled out its parent folders (see excludes_dir)."""
+        node = self.trie
+        for segment in rel_path.split('/'):
+            node = node.get(segment)
+            if node is None: break
+        if node is not None and node.get(_FILE): return True
+        return bool(self.any_glob and self.any_glob.fullmatch(rel_path))
+
+    def matches(self, rel_path):
+        parent = rel_path.rpartition('/')[0]
+        return (bool(parent) and self.excludes_dir(parent)) or self.excludes_file(rel_path)
@@ -0,0 +1,249 @@
+import os
+import sys
+import json
+import time
+import random
+import socket
+import struct
+import hashlib
+import tarfile
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs, unquote
+from blob_store import calculate_blob_sha1
+
+# Synthetic soundpack shapes for benchmarks: file count, size range in bytes, folder count and layout.
+SHAPES = {
+    'scripts': {'files': 50000, 'min_size': 200, 'max_size': 8 * 1024, 'dirs': 500, 'folders': ['scripts'], 'ext': '.set'},
+    'sounds': {'files': 2000, 'min_size': 200 * 1024, 'max_size': 3 * 1024 * 1024, 'dirs': 40, 'folders': ['ogg', 'wav'], 'ext': '.ogg'},
+    'mixed': {'files': 10000, 'min_size': 500, 'max_size': 512 * 1024, 'dirs': 200, 'folders': ['scripts', 'ogg'], 'ext': '.dat'},
+}
+STREAM_CHUNK_SIZE = 64 * 1024
+# Gitea's API.DEFAULT_GIT_TREES_PER_PAGE: larger per_page values are clamped to it.
+TREE_PAGE_SIZE = 1000
+
+def generate_tree(root, shape='scripts', files=None, seed=0):
+    """Writes a deterministic synthetic repository for `shape` under root; returns (file count, total bytes)."""
+    spec = dict(SHAPES[shape])
+    if files: spec['files'] = files
+    rng, total = random.Random(seed), 0
+    for i in range(spec['files']):
+        folder = spec['folders'][i % len(spec['folders'])]
+        rel_dir = os.path.join(folder, f"group{i % spec['dirs']:04d}")
+        os.makedirs(os.path.join(root, rel_dir), exist_ok=True)
+        size = rng.randint(spec['min_size'], spec['max_size'])
+        with open(os.path.join(root, rel_dir, f"file{i:06d}{spec['ext']}"), 'wb') as f: f.write(rng.randbytes(size))
+        total += size
+    return spec['files'], total
+
+class Repository:
+    """A folder served as a single-branch Gitea repository; commit and tree ids change whenever the content does."""
+    def __init__(self, root, branch='main'):
+        self.root, self.branch = root, branch
+        self.refresh()
+
+    def refresh(self):
+        blobs, dir_hashers = [], {}
+        for dirpath, _, filenames in os.walk(self.root):
+            for name in filenames:
+                full_path = os.path.join(dirpath, name)
+                rel_path = os.path.relpath(full_path, self.root).replace(os.sep, '/')
+                blobs.append({'path': rel_path, 'mode': '100644', 'type': 'blob', 'size': os.path.getsize(full_path), 'sha': calculate_blob_sha1(full_path)})
+        blobs.sort(key=lambda e: e['path'])
+        for blob in blobs:
+            parts = blob['path'].split('/')[:-1]
+            for rel_dir in ['/'.join(parts[:i]) for i in range(len(parts) + 1)]:
+                dir_hashers.setdefault(rel_dir, hashlib.sha1()).update(f"{blob['path']} {blob['sha']}\n".encode())
+        self.commit = dir_hashers.setdefault('', hashlib.sha1()).hexdigest()
+        trees = [{'path': rel_dir, 'mode': '040000', 'type': 'tree', 'sha': hasher.hexdigest()} for rel_dir, hasher in dir_hashers.items() if rel_dir]
+        self.tree = sorted(blobs + trees, key=lambda e: e['path'])
+        # Like Gitea, the commit id also names the root tree.
+        self.trees = dict({e['sha']: e['path'] for e in trees}, **{self.commit: ''})
+        self.listings = {}
+
+    def listing(self, sha, recursive):
+        # Entries below the tree `sha`, with paths relative to it; None for an unknown tree.
+        if sha not in self.trees: return None
+        key = (sha, recursive)
+        if key not in self.listings:
+            prefix = self.trees[sha] + '/' if self.trees[sha] else ''
+            entries = (dict(e, path=e['path'][len(prefix):]) for e in self.tree if e['path'].startswith(prefix))
+            self.listings[key] = [e for e in entries if recursive or '/' not in e['path']]
+        return self.listings[key]
+
+class BandwidthLimiter:
+    # Shared by every connection, so the limit models the server's uplink rather than a per-stream cap.
+    def __init__(self, bytes_per_second):
+        self.rate, self.lock, self.next_free = bytes_per_second, threading.Lock(), time.monotonic()
+
+    def consume(self, size):
+        with self.lock:
+            now = time.monotonic()
+            self.next_free = max(self.next_free, now) + size / self.rate
+            delay = self.next_free - size / self.rate - now
+        if delay > 0: time.sleep(delay)
+
+class StandinHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Headers and body go out in separate writes; with Nagle on, every keep-alive response would wait for a delayed ACK.
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args): pass
+
+    def send_body(self, status, body, content_type='application/json', headers=None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in (headers or {}).items(): self.send_header(key, value)
+        self.end_headers()
+        self.write_throttled(body)
+
+    def write_throttled(self, body):
+        limiter = self.server.bandwidth
+        for start in range(0, len(body), STREAM_CHUNK_SIZE):
+            chunk = body[start:start + STREAM_CHUNK_SIZE]
+            if limiter: limiter.consume(len(chunk))
+            self.wfile.write(chunk)
+
+    def do_GET(self):
+        server = self.server
+        server.count_request()
+        if server.latency: time.sleep(server.latency)
+        if server.error_rate and random.random() < server.error_rate:
+            return self.send_body(server.error_status, b'{"message": "injected error"}')
+        parts = urlsplit(self.path)
+        path, query = unquote(parts.path), parse_qs(parts.query)
+        segments = path.strip('/').split('/')
+        if segments[:3] == ['api', 'v1', 'repos'] and len(segments) >= 6:
+            repo = server.repos.get('/'.join(segments[3:5]))
+            if repo is None: return self.send_body(404, b'{"message": "repository not found"}')
+            return self.handle_api(repo, segments[5:], query)
+        if len(segments) >= 5 and segments[2:4] == ['raw', 'branch']:
+            repo = server.repos.get('/'.join(segments[:2]))
+            if repo is None or segments[4] != repo.branch: return self.send_body(404, b'Not found')
+            return self.handle_raw(repo, '/'.join(segments[5:]))
+        self.send_body(404, b'{"message": "not found"}')
+
+    def handle_api(self, repo, segments, query):
+        if segments == ['branches']:
+            return self.send_body(200, json.dumps([{'name': repo.branch, 'commit': {'id': repo.commit}}]).encode())
+        if len(segments) == 2 and segments[0] == 'archive' and segments[1].endswith('.tar.gz'):
+            if segments[1][:-len('.tar.gz')] not in (repo.commit, repo.branch): return self.send_body(404, b'{"message": "unknown ref"}')
+            return self.send_archive(repo)
+        if segments[:2] == ['git', 'trees'] and len(segments) == 3:
+            tree = repo.listing(segments[2], bool(query.get('recursive')))
+            if tree is None: return self.send_body(404, b'{"message": "unknown tree"}')
+            per_page = min(int(query.get('per_page', [0])[0]) or self.server.tree_page_size, self.server.tree_page_size)
+            page = max(int(query.get('page', [1])[0]), 1)
+            entries = tree[(page - 1) * per_page:page * per_page]
+            return self.send_body(200, json.dumps({'sha': segments[2], 'tree': entries, 'truncated': page * per_page < len(tree),
+                                                   'page': page, 'total_count': len(tree)}).encode())
+        self.send_body(404, b'{"message": "not found"}')
+
+    def send_archive(self, repo):
+        # Streamed like Gitea does: no Content-Length, everything below a folder named after the repository.
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/gzip')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+        top = os.path.basename(os.path.normpath(repo.root))
+        with tarfile.open(fileobj=_ThrottledWriter(self, self.server.archive_cut), mode='w|gz') as archive:
+            for entry in repo.tree:
+                if entry['type'] == 'blob': archive.add(os.path.join(repo.root, *entry['path'].split('/')), arcname=f"{top}/{entry['path']}", recursive=False)
+
+    def handle_raw(self, repo, rel_path):
+        full_path = os.path.join(repo.root, *rel_path.split('/'))
+        if not rel_path or not os.path.isfile(full_path): return self.send_body(404, b'Not found')
+        with open(full_path, 'rb') as f: data = f.read()
+        range_header = self.headers.get('Range', '')
+        if range_header.startswith('bytes=') and range_header.endswith('-'):
+            start = int(range_header[6:-1] or 0)
+            if start >= len(data): return self.send_body(416, b'', headers={'Content-Range': f'bytes */{len(data)}'})
+            return self.send_body(206, data[start:], 'application/octet-stream', {'Content-Range': f'bytes {start}-{len(data) - 1}/{len(data)}'})
+        self.send_body(200, data, 'application/octet-stream')
+
+    def reset_connection(self):
+        # SO_LINGER with a zero timeout turns close() into a TCP reset, like a proxy or server dying mid-response.
+        self.connection.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack('ii', 1, 0))
+        self.connection.close()
+        raise ConnectionResetError("archive stream cut")
+
+class _ThrottledWriter:
+    # `cut`, if set, resets the connection once that many bytes have gone out.
+    def __init__(self, handler, cut=None): self.handler, self.left = handler, cut
+    def write(self, data):
+        if self.left is None: return self.handler.write_throttled(data)
+        if self.left <= 0: self.handler.reset_connection()
+        self.handler.write_throttled(data[:self.left])
+        self.left -= len(data)
+        if self.left <= 0: self.handler.reset_connection()
+
+class StandinServer(ThreadingHTTPServer):
+    """Local stand-in for the Gitea endpoints the updater uses, with optional latency, bandwidth limit and error injection.
+
+    `archive_cut` resets archive downloads after that many bytes, to exercise the per-file fallback.
+
+    `repos` maps 'owner/name' to a folder. Port 0 picks a free port; see `base_url`.
+    """
+    daemon_threads = True
+
+    def __init__(self, repos, port=0, latency=0.0, bandwidth=None, error_rate=0.0, error_status=502, tree_page_size=TREE_PAGE_SIZE, archive_cut=None):
+        super().__init__(('127.0.0.1', port), StandinHandler)
+        self.repos = {name: Repository(root) for name, root in repos.items()}
+        self.tree_page_size, self.archive_cut = tree_page_size, archive_cut
+        self.latency, self.error_rate, self.error_status = latency, error_rate, error_status
+        self.bandwidth = BandwidthLimiter(bandwidth) if bandwidth else None
+        self.requests, self.requests_lock = 0, threading.Lock()
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def repo_api_url(self, name):
+        return f"{self.base_url}/api/v1/repos/{name}"
+
+    def handle_error(self, request, client_address):
+        # Clients dropping keep-alive connections is normal here; anything else still gets the default traceback.
+        if not isinstance(sys.exc_info()[1], ConnectionError): super().handle_error(request, client_address)
+
+    def count_request(self):
+        with self.requests_lock: self.requests += 1
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, name='gitea-standin', daemon=True).start()
+        return self
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate and serve synthetic soundpack repositories.")
+    commands = parser.add_subparsers(dest='command', required=True)
+    gen = commands.add_parser('generate', help="Write a synthetic repository.")
+    gen.add_argument('root')
+    gen.add_argument('--shape', choices=sorted(SHAPES), default='scripts')
+    gen.add_argument('--files', type=int)
+    gen.add_argument('--seed', type=int, default=0)
+    serve = commands.add_parser('serve', help="Serve a folder as owner/name over the Gitea API subset.")
+    serve.add_argument('root')
+    serve.add_argument('--name', default='bench/pack')
+    serve.add_argument('--port', type=int, default=3000)
+    serve.add_argument('--latency', type=float, default=0.0, help="Seconds added to every request.")
+    serve.add_argument('--bandwidth', type=float, help="Shared uplink limit in bytes per second.")
+    serve.add_argument('--error-rate', type=float, default=0.0, help="Fraction of requests answered with --error-status.")
+    serve.add_argument('--error-status', type=int, default=502)
+    serve.add_argument('--archive-cut', type=int, help="Reset archive downloads after this many bytes.")
+    serve.add_argument('--tree-page-size', type=int, default=TREE_PAGE_SIZE, help="Most tree entries per page, like Gitea's DEFAULT_GIT_TREES_PER_PAGE.")
+    args = parser.parse_args(argv)
+
+    if args.command == 'generate':
+        count, size = generate_tree(args.root, args.shape, args.files, args.seed)
+        print(f"Generated {count} files ({size} bytes) in {args.root}.")
+        return 0
+    server = StandinServer({args.name: args.root}, args.port, args.latency, args.bandwidth, args.error_rate, args.error_status, args.tree_page_size, args.archive_cut)
+    print(f"Serving {args.root} as {server.repo_api_url(args.name)}")
+    try: server.serve_forever()
+    except KeyboardInterrupt: pass
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
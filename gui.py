@@ -1,11 +1,19 @@
 import wx
 import os
+import queue
 import threading
+import collections
 import config_manager
 from soundpack_manager import SoundpackManager
+from progress import describe_event
 import settings_dialog
 from logger import log
 
+# The log view keeps this many recent lines; the whole run stays available through View > Full Log.
+LOG_VIEW_LINES = 1000
+# Progress events are queued by the worker and drawn in one batch this often.
+UI_REFRESH_MS = 100
+
 class MainFrame(wx.Frame):
     # ... (the rest of the __init__ and InitUI code is the same as the previous step) ...
     # ... (I'm omitting it here for brevity, but make sure you replace the whole file) ...
@@ -15,14 +23,19 @@ class MainFrame(wx.Frame):
         self.is_running = False
         self.worker_thread = None
         self.cancellation_event = threading.Event()
+        self.events = queue.SimpleQueue()
+        self.log_history, self.log_lines, self.log_shown = [], collections.deque(maxlen=LOG_VIEW_LINES), 0
         self.configs = config_manager.load_configs()
         self.current_client_name = self.configs.get('last_selected_client', 'MUSHclient')
         self.InitUI()
         self.MakeMenu()
+        self.CreateStatusBar()
         self.SetSize((600, 450))
         self.SetTitle("Soundpack Updater")
         self.Centre()
         self.Bind(wx.EVT_CLOSE, self.OnClose)
+        self.ui_timer = wx.Timer(self)
+        self.Bind(wx.EVT_TIMER, self.OnDrainEvents, self.ui_timer)
 
     def InitUI(self):
         # This code is unchanged from the previous working accessibility version
@@ -74,9 +87,13 @@ class MainFrame(wx.Frame):
         reset_item = fileMenu.Append(-1, "&Reset All Settings", "Reset all configurations to factory defaults")
         fileMenu.AppendSeparator()
         exit_item = fileMenu.Append(wx.ID_EXIT)
+        viewMenu = wx.Menu()
+        full_log_item = viewMenu.Append(-1, "&Full Log...\tCtrl+L", "Show every message from the current run")
         menuBar = wx.MenuBar()
         menuBar.Append(fileMenu, "&File")
+        menuBar.Append(viewMenu, "&View")
         self.SetMenuBar(menuBar)
+        self.Bind(wx.EVT_MENU, self.OnShowFullLog, full_log_item)
         self.Bind(wx.EVT_MENU, self.OnOpenSettings, settings_item)
         self.Bind(wx.EVT_MENU, self.OnResetSettings, reset_item)
         self.Bind(wx.EVT_MENU, self.OnExit, exit_item)
@@ -94,43 +111,94 @@ class MainFrame(wx.Frame):
 
     def OnTaskFinished(self):
         log.info("Worker thread has finished.")
+        self.ui_timer.Stop()
+        self.OnDrainEvents(None)
         self.SetUIMode('idle')
         self.worker_thread = None
         self.progress_bar.SetValue(0)
+        self.SetStatusText("")
         self.cancel_button.Enable(True)
 
     def worker_target(self, manager):
         log.debug("Worker thread target started.")
         try:
             manager.run_update_or_install()
+            tuned = manager.tuned_workers()
+            if tuned: config_manager.update_config_value(self.current_client_name, 'tuned_workers', tuned)
         finally:
             wx.CallAfter(self.OnTaskFinished)
 
-    def PerformAction(self):
-        log.info("PerformAction called.")
+    def PerformAction(self, full_scan=False):
+        log.info(f"PerformAction called (full_scan={full_scan}).")
         client_config = config_manager.get_client_config(self.current_client_name)
         if not client_config.get('soundpack_path') or not os.path.isdir(client_config.get('soundpack_path')):
             wx.MessageBox("Please locate a valid soundpack directory first.", "Error", wx.OK | wx.ICON_ERROR)
             return
 
         self.SetUIMode('running')
-        self.log_text.Clear()
+        self.ClearLog()
         self.cancellation_event.clear()
+        self.ui_timer.Start(UI_REFRESH_MS)
 
-        manager = SoundpackManager(client_config, self.cancellation_event, self.ProgressUpdate)
+        manager = SoundpackManager(client_config, self.cancellation_event, self.ProgressUpdate, full_scan=full_scan)
         self.worker_thread = threading.Thread(target=self.worker_target, args=(manager,))
         self.worker_thread.daemon = True
         self.worker_thread.start()
 
-    def ProgressUpdate(self, data): wx.CallAfter(self._ProgressUpdateUI, data)
+    # Called from the worker thread; the timer picks the events up on the UI thread.
+    def ProgressUpdate(self, data): self.events.put(data)
 
-    def _ProgressUpdateUI(self, data):
-        if 'message' in data and data['message']: self.log_text.AppendText(data['message'] + '\n')
-        if data.get('total') and data.get('total') > 0:
-            self.progress_bar.SetValue(int((data.get('value', 0) / data.get('total')) * 100))
-        else:
+    def OnDrainEvents(self, event):
+        messages, status, progress, pulse = [], None, None, False
+        while True:
+            try: data = self.events.get_nowait()
+            except queue.Empty: break
+            if data.get('message'): messages.append(data['message'])
+            if data.get('phases'): status = data
+            # Message-only events carry no position; they only pulse the gauge when nothing in the batch had one.
+            if data.get('total') and data['total'] > 0: progress = data
+            else: pulse = True
+        # Only the newest status and gauge position are drawn; the ones in between are already stale.
+        if messages: self.AppendLog(messages)
+        if status: self.SetStatusText(describe_event(status))
+        if progress:
+            value = int((progress.get('value', 0) / progress['total']) * 100)
+            if value != self.progress_bar.GetValue(): self.progress_bar.SetValue(value)
+        elif pulse:
             self.progress_bar.Pulse()
 
+    def AppendLog(self, lines):
+        self.log_history.extend(lines)
+        self.log_lines.extend(lines)
+        # The control may grow to twice the ring size before it is cut back, so trimming stays rare.
+        if self.log_shown + len(lines) > 2 * LOG_VIEW_LINES:
+            self.log_text.SetValue('\n'.join(self.log_lines) + '\n')
+            self.log_text.SetInsertionPointEnd()
+            self.log_shown = len(self.log_lines)
+        else:
+            self.log_text.AppendText('\n'.join(lines) + '\n')
+            self.log_shown += len(lines)
+
+    def ClearLog(self):
+        while True:
+            try: self.events.get_nowait()
+            except queue.Empty: break
+        self.log_history, self.log_shown = [], 0
+        self.log_lines.clear()
+        self.log_text.Clear()
+
+    def OnShowFullLog(self, event):
+        with wx.Dialog(self, title="Full Log", style=wx.DEFAULT_DIALOG_STYLE | wx.RESIZE_BORDER) as dlg:
+            sizer = wx.BoxSizer(wx.VERTICAL)
+            text = wx.TextCtrl(dlg, value='\n'.join(self.log_history), style=wx.TE_MULTILINE | wx.TE_READONLY | wx.HSCROLL, name="Full Log")
+            sizer.Add(text, 1, wx.EXPAND | wx.ALL, 10)
+            sizer.Add(dlg.CreateButtonSizer(wx.CLOSE), 0, wx.EXPAND | wx.LEFT | wx.RIGHT | wx.BOTTOM, 10)
+            dlg.SetSizer(sizer)
+            dlg.SetSize((700, 500))
+            dlg.SetEscapeId(wx.ID_CLOSE)
+            dlg.Centre()
+            dlg.ShowModal()
+
     def OnClose(self, event):
         log.debug("OnClose event triggered.")
         if self.is_running:
@@ -139,16 +207,18 @@ class MainFrame(wx.Frame):
                     event.Veto()
                     return
             self.cancellation_event.set()
+        self.ui_timer.Stop()
+        config_manager.flush_configs()
         self.Destroy()
 
     def OnExit(self, event): self.Close()
-    def OnInstall(self, event): self.PerformAction()
+    def OnInstall(self, event): self.PerformAction(full_scan=True)
     def OnUpdate(self, event): self.PerformAction()
 
     def OnCancel(self, event):
         if self.is_running:
             log.info("Cancel button clicked by user.")
-            self.log_text.AppendText("--- CANCELLATION SIGNAL SENT ---\n")
+            self.AppendLog(["--- CANCELLATION SIGNAL SENT ---"])
             self.cancellation_event.set()
             self.cancel_button.Enable(False)
 
@@ -167,7 +237,7 @@ class MainFrame(wx.Frame):
             if dlg.ShowModal() == wx.ID_YES:
                 log.warning("Settings reset confirmed.")
                 self.configs = config_manager.reset_to_defaults()
-                wx.CallAfter(self.log_text.AppendText, "All settings have been reset to factory defaults.\n")
+                self.AppendLog(["All settings have been reset to factory defaults."])
                 self.current_client_name = self.configs.get('last_selected_client', '')
                 self.client_combo.SetValue(self.current_client_name)
                 self.UpdatePathFromConfig()
@@ -0,0 +1,154 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+from logger import log
+
+HASH_STORE_FILE = 'local_hashes.db'
+LEGACY_HASH_CACHE_FILE = 'local_hashes.json'
+COMMIT_EVERY_ROWS = 500
+COMMIT_EVERY_SECONDS = 2.0
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    root TEXT NOT NULL, path TEXT NOT NULL, size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL,
+    inode INTEGER NOT NULL, sha TEXT NOT NULL, PRIMARY KEY (root, path)) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS dirs (
+    root TEXT NOT NULL, path TEXT NOT NULL, mtime_ns INTEGER NOT NULL, PRIMARY KEY (root, path)) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS manifests (
+    root TEXT NOT NULL, component TEXT NOT NULL, commit_sha TEXT NOT NULL, settings TEXT NOT NULL,
+    synced_at REAL NOT NULL, PRIMARY KEY (root, component)) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS manifest_files (
+    root TEXT NOT NULL, component TEXT NOT NULL, path TEXT NOT NULL, sha TEXT NOT NULL, size INTEGER,
+    PRIMARY KEY (root, component, path)) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS legacy (path TEXT PRIMARY KEY, mtime REAL NOT NULL, sha TEXT NOT NULL) WITHOUT ROWID;
+"""
+
+def store_root(directory):
+    return os.path.normcase(os.path.abspath(directory))
+
+class HashStore:
+    """Blob hashes of local files, keyed by client root and relative path.
+
+    Writes are committed in batches of COMMIT_EVERY_ROWS rows or COMMIT_EVERY_SECONDS seconds,
+    whichever comes first, and once more when a run ends. A cancelled run keeps every hash it
+    computed; a crash loses at most the last uncommitted batch.
+    """
+    def __init__(self, path=HASH_STORE_FILE):
+        self.path = path
+        self.lock = threading.RLock()
+        self.pending, self.last_commit = 0, time.monotonic()
+        self.conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+        # The old JSON cache lived next to the store; a store opened elsewhere (benchmarks, tests) must leave it alone.
+        self.migrate_legacy_cache(os.path.join(os.path.dirname(path), LEGACY_HASH_CACHE_FILE))
+        self.has_legacy = self.conn.execute("SELECT 1 FROM legacy LIMIT 1").fetchone() is not None
+
+    def migrate_legacy_cache(self, legacy_file=LEGACY_HASH_CACHE_FILE):
+        if not os.path.exists(legacy_file): return
+        try:
+            with open(legacy_file, 'r') as f: entries = json.load(f)
+        except (IOError, json.JSONDecodeError) as e:
+            log.warning(f"Could not read legacy hash cache {legacy_file}: {e}"); return
+        # Only blob hashes are worth keeping; raw content hashes never match the tree.
+        rows = [(path, data['mtime'], data['blob_sha']) for path, data in entries.items()
+                if isinstance(data, dict) and data.get('blob_sha') and data.get('mtime') is not None]
+        with self.lock, self.conn:
+            self.conn.executemany("INSERT OR REPLACE INTO legacy (path, mtime, sha) VALUES (?, ?, ?)", rows)
+        os.replace(legacy_file, legacy_file + '.migrated')
+        log.info(f"Migrated {len(rows)} of {len(entries)} entries from {legacy_file} into {self.path}.")
+
+    def load_root(self, root):
+        with self.lock:
+            cursor = self.conn.execute("SELECT path, size, mtime_ns, inode, sha FROM files WHERE root = ?", (root,))
+            return {row[0]: row[1:] for row in cursor}
+
+    def load_dirs(self, root):
+        with self.lock:
+            return dict(self.conn.execute("SELECT path, mtime_ns FROM dirs WHERE root = ?", (root,)))
+
+    def replace_dirs(self, root, dir_mtimes):
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM dirs WHERE root = ?", (root,))
+            self.conn.executemany("INSERT INTO dirs (root, path, mtime_ns) VALUES (?, ?, ?)",
+                                  ((root, path, mtime_ns) for path, mtime_ns in dir_mtimes.items()))
+
+    def forget_dirs(self, root):
+        with self.lock, self.conn: self.conn.execute("DELETE FROM dirs WHERE root = ?", (root,))
+
+    def load_manifest(self, root, component):
+        # The last fully successful sync of a component: (commit_sha, settings, {path: (sha, size)}), or None.
+        with self.lock:
+            row = self.conn.execute("SELECT commit_sha, settings FROM manifests WHERE root = ? AND component = ?", (root, component)).fetchone()
+            if row is None: return None
+            files = self.conn.execute("SELECT path, sha, size FROM manifest_files WHERE root = ? AND component = ?", (root, component))
+            return row[0], row[1], {path: (sha, size) for path, sha, size in files}
+
+    def save_manifest(self, root, component, commit_sha, settings, files):
+        with self.lock, self.conn:
+            self._delete_manifest(root, component)
+            self.conn.execute("INSERT INTO manifests (root, component, commit_sha, settings, synced_at) VALUES (?, ?, ?, ?, ?)",
+                              (root, component, commit_sha, settings, time.time()))
+            self.conn.executemany("INSERT INTO manifest_files (root, component, path, sha, size) VALUES (?, ?, ?, ?, ?)",
+                                  ((root, component, path, sha, size) for path, (sha, size) in files.items()))
+
+    def drop_manifest(self, root, component):
+        with self.lock, self.conn: self._delete_manifest(root, component)
+
+    def _delete_manifest(self, root, component):
+        self.conn.execute("DELETE FROM manifests WHERE root = ? AND component = ?", (root, component))
+        self.conn.execute("DELETE FROM manifest_files WHERE root = ? AND component = ?", (root, component))
+
+    def referenced_shas(self):
+        with self.lock:
+            shas = {row[0] for row in self.conn.execute("SELECT sha FROM files")}
+            shas.update(row[0] for row in self.conn.execute("SELECT sha FROM manifest_files"))
+            return shas
+
+    def prune_missing_roots(self):
+        # Client folders that were deleted or moved should not keep their blobs alive.
+        with self.lock, self.conn:
+            roots = {row[0] for row in self.conn.execute("SELECT DISTINCT root FROM files UNION SELECT DISTINCT root FROM manifests")}
+            for root in roots:
+                if os.path.isdir(root): continue
+                log.info(f"Forgetting hashes for missing folder {root}.")
+                for table in ('files', 'dirs', 'manifests', 'manifest_files'): self.conn.execute(f"DELETE FROM {table} WHERE root = ?", (root,))
+
+    def lookup_legacy(self, full_path, mtime):
+        if not self.has_legacy: return None
+        with self.lock:
+            row = self.conn.execute("SELECT mtime, sha FROM legacy WHERE path = ?", (full_path,)).fetchone()
+        return row[1] if row and row[0] == mtime else None
+
+    def put(self, root, path, size, mtime_ns, inode, sha):
+        with self.lock:
+            self.conn.execute("INSERT OR REPLACE INTO files (root, path, size, mtime_ns, inode, sha) VALUES (?, ?, ?, ?, ?, ?)",
+                              (root, path, size, mtime_ns, inode, sha))
+            self._maybe_commit()
+
+    def put_stat(self, root, path, st, sha):
+        self.put(root, path, st.st_size, st.st_mtime_ns, st.st_ino, sha)
+
+    def delete(self, root, path):
+        with self.lock:
+            self.conn.execute("DELETE FROM files WHERE root = ? AND path = ?", (root, path))
+            self._maybe_commit()
+
+    def _maybe_commit(self):
+        self.pending += 1
+        if self.pending >= COMMIT_EVERY_ROWS or time.monotonic() - self.last_commit >= COMMIT_EVERY_SECONDS: self.commit()
+
+    def commit(self):
+        with self.lock:
+            self.conn.commit()
+            self.pending, self.last_commit = 0, time.monotonic()
+
+    def close(self):
+        with self.lock:
+            try:
+                self.conn.commit()
+                self.conn.close()
+            except sqlite3.Error as e: log.error(f"Failed to close hash store {self.path}: {e}")
@@ -0,0 +1,132 @@
+import time
+import random
+import socket
+import asyncio
+import threading
+import contextlib
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from logger import log
+
+VERIFY_SSL = True
+DEFAULT_POOL_SIZE = 8
+RETRY_TOTAL = 5
+RETRY_BACKOFF_FACTOR = 0.5
+RETRY_BACKOFF_MAX = 30.0
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+class JitteredRetry(Retry):
+    # Full jitter keeps a burst of failed downloads from retrying against the server in lockstep.
+    # Retry-After on 429/503 still wins over this, see respect_retry_after_header.
+    def get_backoff_time(self):
+        backoff = min(super().get_backoff_time(), RETRY_BACKOFF_MAX)
+        return random.uniform(0, backoff) if backoff > 0 else 0
+
+def retry_delay(attempt, retry_after=None):
+    # The same policy as JitteredRetry, for clients that cannot use urllib3's Retry (the asyncio engine).
+    if retry_after and retry_after.strip().isdigit(): return min(float(retry_after), RETRY_BACKOFF_MAX)
+    return random.uniform(0, min(RETRY_BACKOFF_FACTOR * (2 ** attempt), RETRY_BACKOFF_MAX))
+
+def retry_count(response):
+    # How many times urllib3 retried to get this response (0 when it came back first time).
+    retries = getattr(response.raw, 'retries', None)
+    return len(retries.history) if retries else 0
+
+def make_retry():
+    return JitteredRetry(total=RETRY_TOTAL, connect=RETRY_TOTAL, read=RETRY_TOTAL, status=RETRY_TOTAL,
+                         backoff_factor=RETRY_BACKOFF_FACTOR, status_forcelist=RETRY_STATUSES,
+                         allowed_methods=frozenset(['GET', 'HEAD']), respect_retry_after_header=True, raise_on_status=False)
+
+class ConnectionLimiter:
+    """Caps concurrent transfers across every manager that shares it, whatever their own worker counts."""
+    def __init__(self, limit):
+        self.limit = limit
+        self.semaphore = threading.BoundedSemaphore(limit)
+
+    def __enter__(self):
+        self.semaphore.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.semaphore.release()
+
+    async def acquire_async(self):
+        # Polls so a waiting coroutine never blocks the event loop thread.
+        while not self.semaphore.acquire(blocking=False): await asyncio.sleep(0.01)
+
+    def release(self):
+        self.semaphore.release()
+
+class TokenBucket:
+    """Byte budget shared by every transfer of a run, refilled at `rate` bytes per second.
+
+    reserve() books bytes right away and returns how long the caller should wait before using
+    them, so it works for threads (consume) and coroutines (asyncio.sleep on the result) alike.
+    A burst of up to one second's worth is allowed after an idle spell.
+    """
+    def __init__(self, rate):
+        self.rate = float(rate)
+        self.lock = threading.Lock()
+        self.tokens, self.updated = self.rate, time.monotonic()
+
+    def reserve(self, amount):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate) - amount
+            self.updated = now
+            return -self.tokens / self.rate if self.tokens < 0 else 0.0
+
+    def consume(self, amount):
+        delay = self.reserve(amount)
+        if delay: time.sleep(delay)
+
+_sessions, _pool_sizes, _lock = {}, {}, threading.Lock()
+_in_flight, _in_flight_lock = set(), threading.Lock()
+
+def server_key(url):
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}"
+
+def get_session(url, pool_size=DEFAULT_POOL_SIZE):
+    """Returns the shared keep-alive session for the server hosting `url`, growing its pool to `pool_size`."""
+    key = server_key(url)
+    with _lock:
+        session = _sessions.get(key)
+        if session is None:
+            session = _sessions[key] = requests.Session()
+            _pool_sizes[key] = 0
+        if pool_size > _pool_sizes[key]:
+            log.debug(f"Mounting HTTP pool for {key} with {pool_size} connections.")
+            old_adapter = session.adapters.get(key + '/')
+            session.mount(key + '/', HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=make_retry()))
+            if old_adapter: old_adapter.close()
+            _pool_sizes[key] = pool_size
+        return session
+
+@contextlib.contextmanager
+def tracked(response):
+    # Registers a streaming response for abort_transfers() while the caller reads its body.
+    with _in_flight_lock: _in_flight.add(response)
+    try: yield response
+    finally:
+        with _in_flight_lock: _in_flight.discard(response)
+
+def abort_transfers():
+    """Shuts down the socket under every tracked response.
+
+    A thread blocked reading one of them fails at once instead of sitting out its read timeout;
+    the broken connection is dropped from the pool rather than reused.
+    """
+    with _in_flight_lock: responses = list(_in_flight)
+    for response in responses:
+        sock = getattr(getattr(response.raw, 'connection', None), 'sock', None)
+        if sock is None: continue
+        try: sock.shutdown(socket.SHUT_RDWR)
+        except OSError: pass
+
+def close_sessions():
+    with _lock:
+        for session in _sessions.values(): session.close()
+        _sessions.clear(); _pool_sizes.clear()
@@ -0,0 +1,82 @@
+import os
+import time
+
+# Directories modified this recently may still be changing within the same mtime tick,
+# so their listing is not trusted on the next scan (the same trick git uses for racy files).
+RACY_DIR_SECONDS = 2.0
+# Downloads are staged under this suffix until verified; they are not part of the local tree.
+PART_SUFFIX = '.part'
+
+def parent_of(rel_path):
+    return rel_path.rpartition('/')[0]
+
+def stat_matches(cached, st):
+    # Windows DirEntry.stat() reports st_ino as 0, so only compare inodes when both sides know them.
+    size, mtime_ns, inode = cached[0], cached[1], cached[2]
+    return size == st.st_size and mtime_ns == st.st_mtime_ns and (not inode or not st.st_ino or inode == st.st_ino)
+
+def scan_tree(directory, known_files, known_dirs, full_scan=False, prune_dirs=(), exclude=None, cancel_event=None):
+    """Walks `directory` with os.scandir, reusing cached hashes wherever the metadata still matches.
+
+    `known_files` maps relative path -> (size, mtime_ns, inode, sha) and `known_dirs` maps relative
+    directory -> mtime_ns from the previous scan. A directory whose mtime is unchanged has the same
+    entries as last time, so its files are taken from the cache without a stat call and only its
+    subdirectories are checked. Content rewritten in place without touching the directory is only
+    noticed with `full_scan=True`. Relative directories in `prune_dirs` are not entered, and neither
+    are folders or files an `exclude` matcher (see exclusions.ExclusionMatcher) rules out. Once
+    `cancel_event` is set the walk stops at the next directory and returns what it has so far.
+
+    Returns (hashes, to_hash, dir_mtimes): cached hashes by relative path, (full_path, rel_path, stat)
+    tuples that still need hashing, and the directory mtimes to remember once hashing succeeded.
+    """
+    prune_dirs = set(prune_dirs)
+    files_by_dir, dirs_by_parent = {}, {}
+    for rel_path in known_files: files_by_dir.setdefault(parent_of(rel_path), []).append(rel_path)
+    for rel_dir in known_dirs:
+        if rel_dir: dirs_by_parent.setdefault(parent_of(rel_dir), []).append(rel_dir)
+
+    hashes, to_hash, dir_mtimes = {}, [], {}
+    racy_cutoff = time.time_ns() - int(RACY_DIR_SECONDS * 1e9)
+    try: stack = [('', directory, os.stat(directory).st_mtime_ns)]
+    except OSError: return hashes, to_hash, dir_mtimes
+
+    while stack:
+        if cancel_event and cancel_event.is_set(): break
+        rel_dir, abs_dir, mtime_ns = stack.pop()
+        prefix = rel_dir + '/' if rel_dir else ''
+        # A folder holding pruned or excluded entries is listed again next time, so dropping a prune or exclusion brings its files back.
+        trusted = True
+        if not full_scan and known_dirs.get(rel_dir) == mtime_ns:
+            for rel_path in files_by_dir.get(rel_dir, ()):
+                if exclude and exclude.excludes_file(rel_path): trusted = False
+                else: hashes[rel_path] = known_files[rel_path][3]
+            for child in dirs_by_parent.get(rel_dir, ()):
+                if child in prune_dirs: trusted = False; continue
+                if exclude and exclude.excludes_dir(child): trusted = False; continue
+                abs_child = os.path.join(directory, child)
+                try: stack.append((child, abs_child, os.stat(abs_child).st_mtime_ns))
+                except OSError: continue
+            dir_mtimes[rel_dir] = mtime_ns if trusted else 0
+            continue
+
+        try:
+            with os.scandir(abs_dir) as it:
+                for entry in it:
+                    rel_path = prefix + entry.name
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            if rel_path in prune_dirs: trusted = False; continue
+                            if exclude and exclude.excludes_dir(rel_path): trusted = False; continue
+                            stack.append((rel_path, entry.path, entry.stat(follow_symlinks=False).st_mtime_ns))
+                            continue
+                        if not entry.is_file() or entry.name.endswith(PART_SUFFIX): continue
+                        if exclude and exclude.excludes_file(rel_path): trusted = False; continue
+                        st = entry.stat()
+                    except OSError: continue
+                    cached = known_files.get(rel_path)
+                    if cached and stat_matches(cached, st): hashes[rel_path] = cached[3]
+                    else: to_hash.append((entry.path, rel_path, st))
+        except OSError: continue
+        dir_mtimes[rel_dir] = mtime_ns if trusted and mtime_ns < racy_cutoff else 0
+
+    return hashes, to_hash, dir_mtimes
@@ -1,19 +1,41 @@
+import atexit
 import logging
 import os
+import queue
 import sys
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 
-def setup_logger():
-    """Sets up a logger that writes to a file and the console."""
+LOG_FILE = 'log.log'
+METRICS_FILE = 'metrics.jsonl'
+LOG_MAX_BYTES = 5 * 1024 * 1024
+LOG_BACKUPS = 5
+METRICS_MAX_BYTES = 1024 * 1024
+METRICS_BACKUPS = 3
+
+_listeners = []
 
-    # Determine the correct path for the log file
+def app_dir():
     if getattr(sys, 'frozen', False):
         # The application is running as a bundled exe
-        app_dir = os.path.dirname(sys.executable)
-    else:
-        # The application is running as a script
-        app_dir = os.path.dirname(os.path.abspath(__file__))
+        return os.path.dirname(sys.executable)
+    # The application is running as a script
+    return os.path.dirname(os.path.abspath(__file__))
+
+def _queued(logger, handler):
+    # The logger only puts records on a queue; a listener thread does the disk writes, so workers never wait on I/O.
+    log_queue = queue.SimpleQueue()
+    logger.addHandler(QueueHandler(log_queue))
+    listener = QueueListener(log_queue, handler, respect_handler_level=True)
+    listener.start()
+    _listeners.append(listener)
+
+def stop_logging():
+    """Flushes everything still queued to disk; registered with atexit."""
+    while _listeners: _listeners.pop().stop()
 
-    log_file_path = os.path.join(app_dir, 'log.log')
+def setup_logger():
+    """Sets up a logger that writes to a file and the console."""
+    log_file_path = os.path.join(app_dir(), LOG_FILE)
 
     # Configure the logger
     log = logging.getLogger('SoundpackUpdater')
@@ -25,16 +47,36 @@ def setup_logger():
 
     # Create a file handler to write detailed logs to log.log
     try:
-        file_handler = logging.FileHandler(log_file_path, mode='w') # 'w' overwrites the log on each run
+        file_handler = RotatingFileHandler(log_file_path, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUPS, encoding='utf-8', delay=True)
+        # Each run starts a fresh log.log; earlier runs are kept as log.log.1, log.log.2, ...
+        if os.path.exists(log_file_path) and os.path.getsize(log_file_path): file_handler.doRollover()
         file_handler.setLevel(logging.DEBUG)
         formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(module)s - %(message)s')
         file_handler.setFormatter(formatter)
-        log.addHandler(file_handler)
+        _queued(log, file_handler)
     except (IOError, PermissionError) as e:
         # If we can't write to the file, we can't do much, but we should know.
         print(f"FATAL: Could not open log file at {log_file_path}. Error: {e}")
 
     return log
 
+def setup_metrics_logger():
+    """One JSON line per run in metrics.jsonl, kept apart from log.log."""
+    metrics_log = logging.getLogger('SoundpackUpdater.metrics')
+    metrics_log.setLevel(logging.INFO)
+    metrics_log.propagate = False
+    if metrics_log.hasHandlers():
+        metrics_log.handlers.clear()
+    metrics_file_path = os.path.join(app_dir(), METRICS_FILE)
+    try:
+        handler = RotatingFileHandler(metrics_file_path, maxBytes=METRICS_MAX_BYTES, backupCount=METRICS_BACKUPS, encoding='utf-8', delay=True)
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        _queued(metrics_log, handler)
+    except (IOError, PermissionError) as e:
+        print(f"FATAL: Could not open metrics file at {metrics_file_path}. Error: {e}")
+    return metrics_log
+
 # Create a single logger instance to be used by all other modules
-log = setup_logger()
\ No newline at end of file
+log = setup_logger()
+metrics_log = setup_metrics_logger()
+atexit.register(stop_logging)
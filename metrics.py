@@ -0,0 +1,60 @@
+import time
+import json
+import threading
+import contextlib
+from collections import defaultdict
+from logger import metrics_log
+
+class RunMetrics:
+    """Timing spans and counters for one update run.
+
+    Spans are recorded per phase and component ('tree', 'scripts'); counters are kept both in
+    total and per component. `write` appends the whole run as one JSON line to metrics.jsonl.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started_at, self.started = time.time(), time.perf_counter()
+        self.spans = []
+        self.counters = defaultdict(int)
+        self.component_counters = defaultdict(lambda: defaultdict(int))
+
+    @contextlib.contextmanager
+    def span(self, phase, component=None):
+        start = time.perf_counter()
+        try: yield
+        finally:
+            end = time.perf_counter()
+            with self.lock: self.spans.append({'phase': phase, 'component': component, 'start': round(start - self.started, 4), 'seconds': round(end - start, 4)})
+
+    def count(self, name, n=1, component=None):
+        if not n: return
+        with self.lock:
+            self.counters[name] += n
+            if component: self.component_counters[component][name] += n
+
+    def total(self, *names):
+        with self.lock: return sum(self.counters.get(name, 0) for name in names)
+
+    def durations(self):
+        # Wall time per phase; spans of the same phase in parallel components overlap, so this is the union, not the sum.
+        with self.lock: spans = sorted((s['phase'], s['start'], s['start'] + s['seconds']) for s in self.spans)
+        totals = {}
+        for phase, start, end in spans:
+            covered, last_end = totals.get(phase, (0.0, 0.0))
+            totals[phase] = (covered + max(end - max(start, last_end), 0.0), max(last_end, end))
+        return {phase: round(covered, 4) for phase, (covered, _) in totals.items()}
+
+    def snapshot(self, **extra):
+        with self.lock:
+            spans, counters = list(self.spans), dict(self.counters)
+            components = {name: dict(c) for name, c in self.component_counters.items()}
+        lookups = counters.get('cache_hits', 0) + counters.get('cache_misses', 0)
+        return dict(extra, started=time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(self.started_at)),
+                    seconds=round(time.perf_counter() - self.started, 4), durations=self.durations(),
+                    cache_hit_rate=round(counters.get('cache_hits', 0) / lookups, 4) if lookups else None,
+                    counters=counters, components=components, spans=spans)
+
+    def write(self, **extra):
+        snapshot = self.snapshot(**extra)
+        metrics_log.info(json.dumps(snapshot, sort_keys=True))
+        return snapshot
@@ -0,0 +1,118 @@
+import time
+import threading
+from collections import deque
+
+PUBLISH_INTERVAL = 0.25
+RATE_WINDOW = 5.0
+
+def format_bytes(n):
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if abs(n) < 1024 or unit == 'GB': return f"{n:.0f} {unit}" if unit == 'B' else f"{n:.1f} {unit}"
+        n /= 1024
+
+def format_duration(seconds):
+    seconds = int(seconds)
+    return f"{seconds // 3600}:{seconds // 60 % 60:02d}:{seconds % 60:02d}" if seconds >= 3600 else f"{seconds // 60}:{seconds % 60:02d}"
+
+class ProgressTracker:
+    """Thread-safe file and byte counters per phase ('scan', 'hash', 'download').
+
+    Workers report as often as they like; `publish` is called at most every `interval` seconds
+    (and once more the first time a phase completes) with a progress event carrying the counters,
+    the current throughput over the last few seconds and an ETA. `flush` publishes whatever the
+    throttle held back, for the end of a batch.
+    """
+    def __init__(self, publish, interval=PUBLISH_INTERVAL):
+        self.publish, self.interval = publish, interval
+        self.lock = threading.Lock()
+        self.phases, self.samples = {}, {}
+        self.current_phase, self.last_publish = None, 0.0
+        self.completed, self.unpublished = set(), False
+        self.started = time.monotonic()
+
+    def _phase(self, name):
+        if name not in self.phases:
+            now = time.monotonic()
+            self.phases[name] = {'files_done': 0, 'files_total': 0, 'bytes_done': 0, 'bytes_total': 0, 'failed': 0, 'started': now, 'last': now}
+            self.samples[name] = deque()
+        return self.phases[name]
+
+    def add_work(self, phase, files=0, size=0):
+        with self.lock:
+            counters = self._phase(phase)
+            counters['files_total'] += files; counters['bytes_total'] += size or 0
+
+    def advance(self, phase, files=0, size=0, failed=0):
+        with self.lock:
+            counters = self._phase(phase)
+            counters['files_done'] += files; counters['bytes_done'] += size; counters['failed'] += failed
+            now = counters['last'] = time.monotonic()
+            samples = self.samples[phase]
+            samples.append((now, counters['bytes_done'], counters['files_done']))
+            while len(samples) > 2 and now - samples[0][0] > RATE_WINDOW: samples.popleft()
+            self.current_phase = phase
+            # Only the first completion skips the throttle; a phase whose total keeps growing would otherwise publish on every catch-up.
+            first_complete = phase not in self.completed and counters['files_done'] + counters['failed'] >= counters['files_total']
+            if first_complete: self.completed.add(phase)
+            if not first_complete and now - self.last_publish < self.interval:
+                self.unpublished = True
+                return
+            event = self._publishing(now)
+        self.publish(event)
+
+    def flush(self):
+        with self.lock:
+            if not self.unpublished: return
+            event = self._publishing(time.monotonic())
+        self.publish(event)
+
+    def _publishing(self, now):
+        self.last_publish, self.unpublished = now, False
+        return self._event(now)
+
+    def _rates(self, phase, now):
+        samples = self.samples[phase]
+        if len(samples) < 2: return 0.0, 0.0
+        (t0, b0, f0), (_, b1, f1) = samples[0], samples[-1]
+        elapsed = max(now - t0, 1e-3)
+        return (b1 - b0) / elapsed, (f1 - f0) / elapsed
+
+    def _event(self, now):
+        phases = {}
+        for name, counters in self.phases.items():
+            byte_rate, file_rate = self._rates(name, now)
+            remaining_bytes = counters['bytes_total'] - counters['bytes_done']
+            remaining_files = counters['files_total'] - counters['files_done'] - counters['failed']
+            if remaining_files <= 0: eta = 0.0
+            elif counters['bytes_total'] and byte_rate > 0: eta = max(remaining_bytes, 0) / byte_rate
+            elif file_rate > 0: eta = remaining_files / file_rate
+            else: eta = None
+            phases[name] = {k: v for k, v in counters.items() if k not in ('started', 'last')}
+            phases[name].update({'rate': byte_rate, 'files_per_second': file_rate, 'eta': eta, 'elapsed': now - counters['started']})
+        current = phases[self.current_phase]
+        use_bytes = current['bytes_total'] > 0
+        return {'message': None, 'phase': self.current_phase, 'phases': phases,
+                'value': current['bytes_done'] if use_bytes else current['files_done'] + current['failed'],
+                'total': current['bytes_total'] if use_bytes else current['files_total'],
+                'rate': current['rate'], 'eta': current['eta']}
+
+    def totals(self, phase):
+        with self.lock:
+            counters = dict(self._phase(phase))
+            started, last = counters.pop('started'), counters.pop('last')
+            counters['elapsed'], counters['active'] = time.monotonic() - started, last - started
+            return counters
+
+    def summary(self):
+        # Final counters per phase; 'active' is the time from the phase's first work item to its last report.
+        with self.lock: names = list(self.phases)
+        return {name: self.totals(name) for name in names}
+
+def describe_event(event):
+    # One-line human summary of a progress event, e.g. for a status bar.
+    current = event['phases'][event['phase']]
+    text = f"{event['phase'].capitalize()}: {current['files_done'] + current['failed']}/{current['files_total']} files"
+    if current['bytes_total']: text += f", {format_bytes(current['bytes_done'])} of {format_bytes(current['bytes_total'])}"
+    if current['rate']: text += f", {format_bytes(current['rate'])}/s"
+    if current['eta']: text += f", about {format_duration(current['eta'])} left"
+    return text
@@ -20,27 +20,31 @@ class SettingsDialog(wx.Dialog):
         for key, control in self.general_controls.items():
             self.client_config[key] = control.GetValue()
         self.client_config["exclusions"] = [line.strip() for line in self.exclusions_control.GetValue().split('\n') if line.strip()]
-        adv_settings = {
+        adv_settings = dict(self.client_config.get("advanced_settings", {}))
+        adv_settings.update({
             "advanced_enabled": self.enable_checkbox.IsChecked(),
             "scan_workers": self.scan_workers_spin.GetValue(),
-            "download_workers": self.dl_workers_spin.GetValue()
-        }
+            "download_workers": self.dl_workers_spin.GetValue(),
+            "download_engine": self.engine_choice.GetStringSelection(),
+            "async_connections": self.async_connections_spin.GetValue(),
+            "use_blob_store": self.blob_store_checkbox.IsChecked(),
+            "auto_tune": self.auto_tune_checkbox.IsChecked(),
+            "archive_threshold": self.archive_threshold_spin.GetValue() / 100,
+            "max_download_kbps": self.max_kbps_spin.GetValue()
+        })
+        # Counts the tuner learned from the old starting point would override the new ones on the next run.
+        if any(adv_settings.get(key) != self.client_config.get("advanced_settings", {}).get(key) for key in ("scan_workers", "download_workers")):
+            self.client_config.pop("tuned_workers", None)
         self.client_config["advanced_settings"] = adv_settings
         self.all_configs['clients'][self.client_name] = self.client_config
         config_manager.save_configs(self.all_configs)
         self.EndModal(wx.ID_OK)
 
-    # The rest of this file (InitUI, CreateGeneralTab, etc.) is unchanged.
-    # I am omitting it for brevity but you should replace the entire file.
     def InitUI(self):
-        # Unchanged
         self.main_sizer=wx.BoxSizer(wx.VERTICAL);panel=wx.Panel(self);notebook=wx.Notebook(panel);self.CreateGeneralTab(notebook);self.CreateAdvancedTab(notebook);sizer=wx.BoxSizer(wx.VERTICAL);sizer.Add(notebook,1,wx.EXPAND|wx.ALL,5);panel.SetSizer(sizer);self.main_sizer.Add(panel,1,wx.EXPAND|wx.ALL,10);btn_sizer=self.CreateButtonSizer(wx.OK|wx.CANCEL);save_button=self.FindWindowById(wx.ID_OK);save_button.SetLabel("Save");self.main_sizer.Add(btn_sizer,0,wx.EXPAND|wx.LEFT|wx.RIGHT|wx.BOTTOM,10);self.Bind(wx.EVT_BUTTON,self.OnSave,id=wx.ID_OK)
     def CreateGeneralTab(self,notebook):
-        # Unchanged
-        panel=wx.Panel(notebook);grid=wx.FlexGridSizer(5,2,10,10);fields={"scripts_repo_url":"Scripts Repo URL:","sounds_repo_url":"Sounds Repo URL:","scripts_target_subdir":"Scripts Target Subdirectory:","sounds_target_subdir":"Sounds Target Subdirectory:","sounds_subfolder":"Repo Sounds Subfolder (e.g., ogg):"};self.general_controls={};[self.general_controls.update({key:wx.TextCtrl(panel,value=str(self.client_config.get(key,"")),name=text)})or grid.Add(wx.StaticText(panel,label=text),0,wx.ALIGN_RIGHT|wx.ALIGN_CENTER_VERTICAL)or grid.Add(self.general_controls[key],1,wx.EXPAND)for key,text in fields.items()];label=wx.StaticText(panel,label="Exclusions (one per line):");value="\n".join(self.client_config.get("exclusions",[]));control=wx.TextCtrl(panel,value=value,style=wx.TE_MULTILINE);self.exclusions_control=control;main_sizer=wx.BoxSizer(wx.VERTICAL);main_sizer.Add(grid,0,wx.EXPAND|wx.ALL,10);main_sizer.Add(label,0,wx.LEFT|wx.RIGHT|wx.TOP,10);main_sizer.Add(control,1,wx.EXPAND|wx.LEFT|wx.RIGHT|wx.BOTTOM,10);grid.AddGrowableCol(1,1);panel.SetSizer(main_sizer);notebook.AddPage(panel,"General")
+        panel=wx.Panel(notebook);grid=wx.FlexGridSizer(5,2,10,10);fields={"scripts_repo_url":"Scripts Repo URL:","sounds_repo_url":"Sounds Repo URL:","scripts_target_subdir":"Scripts Target Subdirectory:","sounds_target_subdir":"Sounds Target Subdirectory:","sounds_subfolder":"Repo Sounds Subfolder (e.g., ogg):"};self.general_controls={};[self.general_controls.update({key:wx.TextCtrl(panel,value=str(self.client_config.get(key,"")),name=text)})or grid.Add(wx.StaticText(panel,label=text),0,wx.ALIGN_RIGHT|wx.ALIGN_CENTER_VERTICAL)or grid.Add(self.general_controls[key],1,wx.EXPAND)for key,text in fields.items()];label=wx.StaticText(panel,label="Exclusions (one per line; folder/ for a whole folder, * and ** wildcards):");value="\n".join(self.client_config.get("exclusions",[]));control=wx.TextCtrl(panel,value=value,style=wx.TE_MULTILINE);self.exclusions_control=control;main_sizer=wx.BoxSizer(wx.VERTICAL);main_sizer.Add(grid,0,wx.EXPAND|wx.ALL,10);main_sizer.Add(label,0,wx.LEFT|wx.RIGHT|wx.TOP,10);main_sizer.Add(control,1,wx.EXPAND|wx.LEFT|wx.RIGHT|wx.BOTTOM,10);grid.AddGrowableCol(1,1);panel.SetSizer(main_sizer);notebook.AddPage(panel,"General")
     def CreateAdvancedTab(self,notebook):
-        # Unchanged
-        panel=wx.Panel(notebook);adv_settings=self.client_config.get("advanced_settings",{});warning_text="WARNING: Modifying these settings can significantly increase CPU, memory, and network usage. Proceed with caution.";warning_field=wx.TextCtrl(panel,value=warning_text,style=wx.TE_MULTILINE|wx.TE_READONLY|wx.TE_NO_VSCROLL);warning_field.SetBackgroundColour(wx.SystemSettings.GetColour(wx.SYS_COLOUR_INFOBK));self.enable_checkbox=wx.CheckBox(panel,label="I understand the risks and wish to change advanced settings.");self.enable_checkbox.SetValue(adv_settings.get("advanced_enabled",False));grid=wx.FlexGridSizer(2,2,10,10);scan_label=wx.StaticText(panel,label="File Scan Workers:");self.scan_workers_spin=wx.SpinCtrl(panel,value=str(adv_settings.get("scan_workers",4)),min=1,max=16);dl_label=wx.StaticText(panel,label="Parallel Download Workers:");self.dl_workers_spin=wx.SpinCtrl(panel,value=str(adv_settings.get("download_workers",8)),min=1,max=32);grid.Add(scan_label,0,wx.ALIGN_RIGHT|wx.ALIGN_CENTER_VERTICAL);grid.Add(self.scan_workers_spin,0);grid.Add(dl_label,0,wx.ALIGN_RIGHT|wx.ALIGN_CENTER_VERTICAL);grid.Add(self.dl_workers_spin,0);main_sizer=wx.BoxSizer(wx.VERTICAL);main_sizer.Add(warning_field,0,wx.EXPAND|wx.ALL,10);main_sizer.Add(self.enable_checkbox,0,wx.ALL,10);main_sizer.Add(grid,0,wx.ALL,10);panel.SetSizer(main_sizer);notebook.AddPage(panel,"Advanced");self.Bind(wx.EVT_CHECKBOX,self.OnToggleAdvanced,self.enable_checkbox);self.OnToggleAdvanced(None)
+        panel=wx.Panel(notebook);adv_settings=self.client_config.get("advanced_settings",{});warning_text="WARNING: Modifying these settings can significantly increase CPU, memory, and network usage. Proceed with caution.";warning_field=wx.TextCtrl(panel,value=warning_text,style=wx.TE_MULTILINE|wx.TE_READONLY|wx.TE_NO_VSCROLL);warning_field.SetBackgroundColour(wx.SystemSettings.GetColour(wx.SYS_COLOUR_INFOBK));self.enable_checkbox=wx.CheckBox(panel,label="I understand the risks and wish to change advanced settings.");self.enable_checkbox.SetValue(adv_settings.get("advanced_enabled",False));grid=wx.FlexGridSizer(6,2,10,10);scan_label=wx.StaticText(panel,label="File Scan Workers:");self.scan_workers_spin=wx.SpinCtrl(panel,value=str(adv_settings.get("scan_workers",4)),min=1,max=16);dl_label=wx.StaticText(panel,label="Parallel Download Workers:");self.dl_workers_spin=wx.SpinCtrl(panel,value=str(adv_settings.get("download_workers",8)),min=1,max=32);grid.Add(scan_label,0,wx.ALIGN_RIGHT|wx.ALIGN_CENTER_VERTICAL);grid.Add(self.scan_workers_spin,0);grid.Add(dl_label,0,wx.ALIGN_RIGHT|wx.ALIGN_CENTER_VERTICAL);grid.Add(self.dl_workers_spin,0);engine_label=wx.StaticText(panel,label="Download &Engine:");self.engine_choice=wx.Choice(panel,choices=["threads","asyncio"]);self.engine_choice.SetStringSelection(adv_settings.get("download_engine","threads"));conn_label=wx.StaticText(panel,label="Asyncio Connections:");self.async_connections_spin=wx.SpinCtrl(panel,value=str(adv_settings.get("async_connections",128)),min=1,max=512);grid.Add(engine_label,0,wx.ALIGN_RIGHT|wx.ALIGN_CENTER_VERTICAL);grid.Add(self.engine_choice,0);grid.Add(conn_label,0,wx.ALIGN_RIGHT|wx.ALIGN_CENTER_VERTICAL);grid.Add(self.async_connections_spin,0);archive_label=wx.StaticText(panel,label="Use Archive When % of Files Change (0 = never):");self.archive_threshold_spin=wx.SpinCtrl(panel,value=str(round(adv_settings.get("archive_threshold",0.5)*100)),min=0,max=100);grid.Add(archive_label,0,wx.ALIGN_RIGHT|wx.ALIGN_CENTER_VERTICAL);grid.Add(self.archive_threshold_spin,0);kbps_label=wx.StaticText(panel,label="Download Speed Limit (KB/s, 0 = unlimited):");self.max_kbps_spin=wx.SpinCtrl(panel,value=str(adv_settings.get("max_download_kbps",0)),min=0,max=1000000);grid.Add(kbps_label,0,wx.ALIGN_RIGHT|wx.ALIGN_CENTER_VERTICAL);grid.Add(self.max_kbps_spin,0);self.blob_store_checkbox=wx.CheckBox(panel,label="&Share downloaded files with other clients through a local blob store");self.blob_store_checkbox.SetValue(adv_settings.get("use_blob_store",False));main_sizer=wx.BoxSizer(wx.VERTICAL);main_sizer.Add(warning_field,0,wx.EXPAND|wx.ALL,10);main_sizer.Add(self.enable_checkbox,0,wx.ALL,10);self.auto_tune_checkbox=wx.CheckBox(panel,label="&Tune scan and download workers automatically (the values below are the starting point)");self.auto_tune_checkbox.SetValue(adv_settings.get("auto_tune",False));main_sizer.Add(self.auto_tune_checkbox,0,wx.LEFT|wx.RIGHT,10);main_sizer.Add(grid,0,wx.ALL,10);main_sizer.Add(self.blob_store_checkbox,0,wx.ALL,10);panel.SetSizer(main_sizer);notebook.AddPage(panel,"Advanced");self.Bind(wx.EVT_CHECKBOX,self.OnToggleAdvanced,self.enable_checkbox);self.Bind(wx.EVT_CHECKBOX,self.OnToggleAdvanced,self.auto_tune_checkbox);self.OnToggleAdvanced(None)
     def OnToggleAdvanced(self,event):
-        # Unchanged
-        enabled=self.enable_checkbox.IsChecked();self.scan_workers_spin.Enable(enabled);self.dl_workers_spin.Enable(enabled)
\ No newline at end of file
+        enabled=self.enable_checkbox.IsChecked();self.auto_tune_checkbox.Enable(enabled);self.scan_workers_spin.Enable(enabled);self.dl_workers_spin.Enable(enabled);self.engine_choice.Enable(enabled);self.async_connections_spin.Enable(enabled);self.archive_threshold_spin.Enable(enabled);self.max_kbps_spin.Enable(enabled);self.blob_store_checkbox.Enable(enabled)
\ No newline at end of file
@@ -1,22 +1,60 @@
 import os
 import json
+import time
+import zlib
+import tarfile
+import contextlib
+import urllib3
 import requests
-import hashlib
 import threading
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed, wait
+from auto_tune import AdjustableLimit, ConcurrencyTuner, TUNE_INTERVAL
+from blob_store import BlobStore, git_blob_hasher, calculate_blob_sha1, hash_file_prefix
+from download_engines import create_download_engine
+from exclusions import ExclusionMatcher
+from hash_store import HashStore, store_root
+from http_client import TokenBucket, abort_transfers, get_session, retry_count, tracked, VERIFY_SSL
+from local_scanner import scan_tree, PART_SUFFIX
+from metrics import RunMetrics
+from progress import ProgressTracker, format_bytes, format_duration
+from tree_stream import iter_tree_entries
 from logger import log
 
-VERIFY_SSL = True
-HASH_CACHE_FILE = 'local_hashes.json'
-
-def get_remote_tree_fast(repo_api_url, cancellation_event):
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+MAX_REPORTED_FAILURES = 20
+RESUME_ATTEMPTS = 3
+# Gitea clamps git/trees pages to API.DEFAULT_GIT_TREES_PER_PAGE (1000 by default) and sets 'truncated' when more follow.
+TREE_PAGE_SIZE = 1000
+TREE_PAGE_WORKERS = 4
+TREE_CHUNK_SIZE = 64 * 1024
+# A change set covering at least this share of a component's files is fetched as one repository archive (advanced_settings 'archive_threshold', 0 turns it off).
+ARCHIVE_THRESHOLD = 0.5
+ARCHIVE_MIN_FILES = 500
+# Per-request overhead only dominates for small files; big ones stream just as well one by one, and the archive also carries folders this client skips.
+ARCHIVE_MAX_AVERAGE_SIZE = 256 * 1024
+ARCHIVE_CHUNK_SIZE = 256 * 1024
+# How often a running update looks at the cancellation event, and how long it then waits for transfers that are still connecting.
+CANCEL_POLL_INTERVAL = 0.1
+CANCEL_GRACE = 0.5
+# In auto mode (advanced_settings 'auto_tune') worker counts move within these bounds, the same ones the settings dialog allows.
+SCAN_WORKER_MAX = 16
+DOWNLOAD_WORKER_MAX = 32
+# Download throughput is judged as bytes plus this much per finished file. The scheduler sends small files first, so bytes
+# alone would climb through a run whatever the worker count, while the per-request round trip is what extra workers hide.
+TUNE_REQUEST_COST = 64 * 1024
+
+def get_remote_branch(repo_api_url):
+    # Resolves the default branch and its head commit, which is all a no-op update needs from the server.
     try:
         sanitized_repo_url = repo_api_url.rstrip('/').replace('/contents', '')
         parts = sanitized_repo_url.split('/api/v1/repos/')
         server_base, repo_full_name = parts[0], parts[1]
 
+        session = get_session(sanitized_repo_url)
         branches_url = f"{sanitized_repo_url}/branches"
-        branches_list = requests.get(branches_url, verify=VERIFY_SSL, timeout=15).json()
+        branches_response = session.get(branches_url, verify=VERIFY_SSL, timeout=15)
+        branches_response.raise_for_status()
+        branches_list = branches_response.json()
 
         if not isinstance(branches_list, list) or not branches_list:
             raise RuntimeError("Server API Error: Could not find any branches for this repository.")
@@ -28,178 +66,661 @@ def get_remote_tree_fast(repo_api_url, cancellation_event):
         else: default_branch_details = branches_list[0]
 
         default_branch_name = default_branch_details.get('name')
-        commit_sha = default_branch_details.get('commit', {}).get('id')
-        if not commit_sha or cancellation_event.is_set(): return {}
+        return {'api_url': sanitized_repo_url, 'branch': default_branch_name, 'commit': default_branch_details.get('commit', {}).get('id'),
+                'download_base': f"{server_base}/{repo_full_name}/raw/branch/{default_branch_name}"}
+    except requests.exceptions.RequestException as e:
+        log.critical(f"FATAL NETWORK ERROR in get_remote_branch: {e}", exc_info=True)
+        return None
+    except Exception as e:
+        log.critical(f"FATAL UNEXPECTED ERROR in get_remote_branch: {e}", exc_info=True)
+        return None
 
-        tree_url = f"{sanitized_repo_url}/git/trees/{commit_sha}?recursive=1"
-        tree_response = requests.get(tree_url, verify=VERIFY_SSL, timeout=20).json()
-        if 'tree' not in tree_response: return {}
+def fetch_tree_page(api_url, sha, page, recursive, convert):
+    # Entries are converted as they are parsed off the wire; convert() returning None drops one.
+    meta, params = {}, {'page': page, 'per_page': TREE_PAGE_SIZE}
+    if recursive: params['recursive'] = 1
+    with get_session(api_url).get(f"{api_url}/git/trees/{sha}", params=params, stream=True, verify=VERIFY_SSL, timeout=20) as r, tracked(r):
+        r.raise_for_status()
+        items, count = [], 0
+        for entry in iter_tree_entries(r.iter_content(chunk_size=TREE_CHUNK_SIZE), meta):
+            count += 1
+            item = convert(entry)
+            if item is not None: items.append(item)
+    meta['count'] = count
+    return items, meta
+
+def fetch_tree(api_url, sha, recursive, convert, cancellation_event):
+    """Every entry of tree `sha` across all pages, passed through convert(). Returns None if cancelled."""
+    items, meta = fetch_tree_page(api_url, sha, 1, recursive, convert)
+    page = 1
+    if meta.get('truncated') and meta.get('total_count') and meta['count']:
+        # The first page tells how many more there are, so fetch those side by side.
+        last_page = -(-meta['total_count'] // meta['count'])
+        with ThreadPoolExecutor(max_workers=TREE_PAGE_WORKERS, thread_name_prefix='tree-page') as ex:
+            pages = [ex.submit(fetch_tree_page, api_url, sha, n, recursive, convert) for n in range(2, last_page + 1)]
+            for future in pages:
+                if cancellation_event.is_set():
+                    for f in pages: f.cancel()
+                    return None
+                page_items, meta = future.result()
+                items.extend(page_items)
+        page = last_page
+    # Without a usable total_count (or if it was off), keep following 'truncated' one page at a time.
+    while meta.get('truncated') and meta['count']:
+        if cancellation_event.is_set(): return None
+        page += 1
+        page_items, meta = fetch_tree_page(api_url, sha, page, recursive, convert)
+        items.extend(page_items)
+    return items
+
+def get_remote_tree_fast(repo_api_url, cancellation_event, branch_info=None, subfolder=None):
+    """Remote blobs as {path: {'sha', 'size', 'url'}}, limited to `subfolder` when one is given.
+
+    Returns None on errors and {} when cancelled. Paths are always relative to the repository root.
+    """
+    if branch_info is None: branch_info = get_remote_branch(repo_api_url)
+    if branch_info is None: return None
+    try:
+        commit_sha = branch_info['commit']
+        if not commit_sha or cancellation_event.is_set(): return {}
 
-        file_list = {}
-        base_download_url = f"{server_base}/{repo_full_name}/raw/branch/{default_branch_name}"
-        for item in tree_response['tree']:
-            if item.get('type') == 'blob':
-                file_list[item['path']] = {'sha': item['sha'], 'url': f"{base_download_url}/{item['path']}"}
-        return file_list
+        api_url, tree_sha, prefix = branch_info['api_url'], commit_sha, ''
+        # Walk down to the subfolder's own tree, so the rest of the repository is never listed.
+        for segment in (subfolder or '').strip('/').split('/') if subfolder else ():
+            subtrees = fetch_tree(api_url, tree_sha, False, lambda e, name=segment: e['sha'] if e.get('type') == 'tree' and e.get('path') == name else None,
+                                  cancellation_event)
+            if subtrees is None: return {}
+            if not subtrees:
+                log.warning(f"Folder '{prefix}{segment}' was not found in {api_url} at {commit_sha}.")
+                return {}
+            tree_sha, prefix = subtrees[0], f"{prefix}{segment}/"
+
+        base_download_url = f"{branch_info['download_base']}/{prefix}"
+        blobs = fetch_tree(api_url, tree_sha, True, lambda e: (e['path'], e['sha'], e.get('size')) if e.get('type') == 'blob' else None, cancellation_event)
+        if blobs is None: return {}
+        return {prefix + path: {'sha': sha, 'size': size, 'url': base_download_url + path} for path, sha, size in blobs}
     except requests.exceptions.RequestException as e:
+        if cancellation_event.is_set(): return {}  # The listing was cut off by the cancel.
         log.critical(f"FATAL NETWORK ERROR in get_remote_tree_fast: {e}", exc_info=True)
         return None
     except Exception as e:
+        if cancellation_event.is_set(): return {}
         log.critical(f"FATAL UNEXPECTED ERROR in get_remote_tree_fast: {e}", exc_info=True)
         return None
 
-def calculate_sha1(filepath):
-    try:
-        with open(filepath, 'rb') as f: return hashlib.sha1(f.read()).hexdigest()
-    except IOError: return None
-
-def is_excluded(filepath, exclusions):
-    for exclusion in exclusions:
-        if exclusion.endswith('/') and filepath.startswith(exclusion): return True
-        elif filepath == exclusion: return True
-    return False
+def missing_file_checker():
+    # Existence checks for many files in few folders; a folder found missing answers for everything below it.
+    dir_exists = {}
+    def is_missing(path):
+        parent = os.path.dirname(path)
+        if parent not in dir_exists: dir_exists[parent] = os.path.isdir(parent)
+        return not dir_exists[parent] or not os.path.lexists(path)
+    return is_missing
 
 class SoundpackManager:
-    def __init__(self, config, cancellation_event, progress_callback=None):
+    def __init__(self, config, cancellation_event, progress_callback=None, full_scan=False, hash_store=None, connection_limiter=None):
         self.config = config
+        self.full_scan = full_scan
         self.cancellation_event = cancellation_event
         self.progress_callback = progress_callback
-        self.hash_cache = self.load_hash_cache()
+        # A hash store passed in is shared with other managers (the CLI runs several clients) and stays open after the run.
+        self.owns_hash_store = hash_store is None
+        self.hash_store = hash_store or HashStore()
+        self.connection_limiter = connection_limiter
+        # advanced_settings 'max_download_kbps' caps the run's combined download speed; 0 means no limit.
+        max_kbps = config.get('advanced_settings', {}).get('max_download_kbps', 0)
+        self.bandwidth = TokenBucket(max_kbps * 1024) if max_kbps else None
+        self.errors = []
+        self.blob_store = BlobStore() if config.get('advanced_settings', {}).get('use_blob_store') else None
+        self.failures = []
+        self.engine, self.engine_lock = None, threading.Lock()
+        self.progress = ProgressTracker(self.publish_progress)
+        self.metrics = RunMetrics()
+        self.cancelled_at = None
+        # Set up by start_tuning(); without them the configured worker counts are used as they are.
+        self.scan_limit = self.download_limit = None
+        self.tuners = []
 
     def send_progress(self, message, value=None, total=None):
         if self.progress_callback and not self.cancellation_event.is_set():
             self.progress_callback({'message': message, 'value': value, 'total': total})
 
-    def load_hash_cache(self):
-        try:
-            if os.path.exists(HASH_CACHE_FILE):
-                with open(HASH_CACHE_FILE, 'r') as f: return json.load(f)
-        except (IOError, json.JSONDecodeError): pass
-        return {}
-
-    def save_hash_cache(self):
-        try:
-            with open(HASH_CACHE_FILE, 'w') as f: json.dump(self.hash_cache, f, indent=4)
-        except IOError: pass
-
-    def get_local_file_hashes(self, directory, num_workers):
+    def report_error(self, message):
+        self.errors.append(message)
+        self.send_progress(f"ERROR: {message}")
+
+    def connection_slot(self):
+        return self.connection_limiter or contextlib.nullcontext()
+
+    def publish_progress(self, event):
+        if self.progress_callback and not self.cancellation_event.is_set(): self.progress_callback(event)
+
+    def watch_run(self, finished):
+        # The caller only sets an event; this turns it into action while the run is going, and steps the auto-tuners.
+        next_tune = time.monotonic() + TUNE_INTERVAL
+        while not finished.wait(CANCEL_POLL_INTERVAL):
+            if self.cancellation_event.is_set():
+                self.cancelled_at = time.monotonic()
+                log.info("Cancellation requested, dropping queued downloads and closing open transfers.")
+                self.abort()
+                return
+            if self.tuners and time.monotonic() >= next_tune:
+                for tuner in self.tuners: tuner.tick()
+                next_tune = time.monotonic() + TUNE_INTERVAL
+
+    def start_tuning(self, scan_workers, dl_workers):
+        """Switches to adjustable worker counts, starting from what the last run of this client settled on."""
+        tuned = self.config.get('tuned_workers', {})
+        adv_settings = self.config.get('advanced_settings', {})
+        dl_max = DOWNLOAD_WORKER_MAX if adv_settings.get('download_engine', 'threads') == 'threads' else adv_settings.get('async_connections', DOWNLOAD_WORKER_MAX)
+        scan_workers = min(max(tuned.get('scan_workers', scan_workers), 1), SCAN_WORKER_MAX)
+        dl_workers = min(max(tuned.get('download_workers', dl_workers), 1), dl_max)
+        self.scan_limit, self.download_limit = AdjustableLimit(scan_workers), AdjustableLimit(dl_workers)
+        self.tuners = [
+            ConcurrencyTuner('scan_workers', self.scan_limit, 1, SCAN_WORKER_MAX, lambda: (self.metrics.total('bytes_hashed'), 0)),
+            ConcurrencyTuner('download_workers', self.download_limit, 1, dl_max,
+                             lambda: (self.metrics.total('bytes_downloaded') + TUNE_REQUEST_COST * self.metrics.total('files_downloaded'),
+                                      self.metrics.total('retries', 'failures')), self.resize_downloads),
+        ]
+        log.info(f"Auto-tuning worker counts, starting at {scan_workers} scan and {dl_workers} download workers.")
+
+    def resize_downloads(self, workers):
+        with self.engine_lock:
+            if self.engine is not None: self.engine.scheduler.resize(workers)
+
+    def tuned_workers(self):
+        """Worker counts to start the client's next run with, or None when there is nothing new to remember."""
+        if not self.tuners or self.cancellation_event.is_set(): return None
+        measured = {tuner.name: tuner.best_level for tuner in self.tuners if tuner.measured}
+        return dict(self.config.get('tuned_workers', {}), **measured) if measured else None
+
+    def download_slot(self):
+        return self.download_limit or contextlib.nullcontext()
+
+    def hash_file(self, full_path):
+        # calculate_blob_sha1 behind the adjustable scan limit.
+        with self.scan_limit:
+            if self.cancellation_event.is_set(): return None
+            return calculate_blob_sha1(full_path)
+
+    def abort(self):
+        with self.engine_lock: engine = self.engine
+        if engine: engine.cancel()
+        abort_transfers()
+
+    def call_cancellable(self, fn, *args):
+        """Runs a blocking request on its own thread and returns its result, or None once cancelled.
+
+        A cancel does not have to sit out the request's timeout; the abandoned thread ends on its own.
+        """
+        future = Future()
+        def run():
+            try: future.set_result(fn(*args))
+            except BaseException as e: future.set_exception(e)
+        threading.Thread(target=run, name='request', daemon=True).start()
+        while not wait([future], timeout=CANCEL_POLL_INTERVAL).done:
+            if self.cancellation_event.is_set(): return None
+        return future.result()
+
+    def wait_downloads(self, futures):
+        # After a cancel, transfers still connecting get CANCEL_GRACE seconds and are then left to finish in the background.
+        pending = futures
+        while pending:
+            pending = wait(pending, timeout=CANCEL_POLL_INTERVAL).not_done
+            if self.cancelled_at is not None and time.monotonic() - self.cancelled_at > CANCEL_GRACE: break
+        self.progress.flush()
+
+    def get_local_file_hashes(self, directory, num_workers, prune_dirs=(), comp_name=None, exclude=None):
         self.send_progress(f"Scanning local files in '{os.path.basename(directory) or 'main folder'}'...")
-        if not os.path.exists(directory):
-            self.send_progress(None, 1, 1); return {}
-
-        current_hashes, files_to_hash = {}, []
-        for root, _, files in os.walk(directory):
-            for name in files:
-                full_path, rel_path = os.path.join(root, name), os.path.relpath(os.path.join(root, name), directory).replace('\\', '/')
-                try:
-                    mtime, cached_data = os.path.getmtime(full_path), self.hash_cache.get(full_path)
-                    if cached_data and cached_data.get('mtime') == mtime: current_hashes[rel_path] = cached_data['sha']
-                    else: files_to_hash.append((full_path, rel_path, mtime))
-                except OSError: continue
+        if not os.path.exists(directory): return {}
+
+        root_key = store_root(directory)
+        self.progress.add_work('scan')
+        with self.metrics.span('scan', comp_name):
+            known = self.hash_store.load_root(root_key)
+            current_hashes, candidates, dir_mtimes = scan_tree(directory, known, self.hash_store.load_dirs(root_key), self.full_scan, prune_dirs, exclude,
+                                                               self.cancellation_event)
+            # A partial walk must not prune the cache of the files it never reached.
+            if self.cancellation_event.is_set(): return current_hashes
+            self.metrics.count('cache_hits', len(current_hashes), comp_name)
+            files_to_hash = []
+            for full_path, rel_path, st in candidates:
+                legacy_sha = self.hash_store.lookup_legacy(full_path, st.st_mtime)
+                if legacy_sha: current_hashes[rel_path] = legacy_sha; self.hash_store.put_stat(root_key, rel_path, st, legacy_sha)
+                else: files_to_hash.append((full_path, rel_path, st))
+            self.metrics.count('legacy_hits', len(candidates) - len(files_to_hash), comp_name)
+            self.metrics.count('cache_misses', len(files_to_hash), comp_name)
+
+            seen = current_hashes.keys() | {f[1] for f in files_to_hash}
+            for rel_path in known.keys() - seen: self.hash_store.delete(root_key, rel_path)
+            self.metrics.count('files_scanned', len(seen), comp_name)
+            self.progress.add_work('scan', files=len(seen))
+            self.progress.advance('scan', files=len(seen))
 
         if not files_to_hash:
-            self.send_progress(None, 1, 1); return current_hashes
-
-        with ThreadPoolExecutor(max_workers=num_workers) as ex:
-            future_map = {ex.submit(calculate_sha1, f[0]): f for f in files_to_hash}
-            for future in future_map:
-                if self.cancellation_event.is_set(): return {}
-                full_path, rel_path, mtime = future_map[future]
-                sha1 = future.result()
-                if sha1: current_hashes[rel_path], self.hash_cache[full_path] = sha1, {'mtime': mtime, 'sha': sha1}
-
-        self.send_progress(None, 1, 1)
+            self.hash_store.replace_dirs(root_key, dir_mtimes)
+            return current_hashes
+
+        self.progress.add_work('hash', files=len(files_to_hash), size=sum(f[2].st_size for f in files_to_hash))
+        with self.metrics.span('hash', comp_name):
+            # In auto mode the pool is sized for the most workers the tuner may allow, and scan_limit decides how many actually run.
+            ex = ThreadPoolExecutor(max_workers=SCAN_WORKER_MAX if self.scan_limit else num_workers)
+            hash_file = self.hash_file if self.scan_limit else calculate_blob_sha1
+            try:
+                future_map = {ex.submit(hash_file, f[0]): f for f in files_to_hash}
+                unrecorded = set(future_map)
+                for future in as_completed(future_map):
+                    if self.cancellation_event.is_set(): break
+                    unrecorded.discard(future)
+                    self.record_hash(root_key, future_map[future], future.result(), current_hashes, comp_name)
+            finally:
+                # Queued files are dropped on cancel; the few being hashed right now finish in the background.
+                ex.shutdown(wait=False, cancel_futures=True)
+        if self.cancellation_event.is_set():
+            # Keep every hash that did finish, so the next run starts from there.
+            for future in unrecorded:
+                if future.done() and not future.cancelled(): self.record_hash(root_key, future_map[future], future.result(), current_hashes, comp_name)
+            return {}
+
+        # Directory listings may only be trusted next time if every file in them made it into the store.
+        if len(current_hashes) == len(seen): self.hash_store.replace_dirs(root_key, dir_mtimes)
+        else: self.hash_store.forget_dirs(root_key)
         return current_hashes
 
+    def record_hash(self, root_key, file_info, sha1, current_hashes, comp_name):
+        full_path, rel_path, st = file_info
+        self.progress.advance('hash', files=1 if sha1 else 0, size=st.st_size if sha1 else 0, failed=0 if sha1 else 1)
+        if sha1:
+            current_hashes[rel_path] = sha1; self.hash_store.put_stat(root_key, rel_path, st, sha1)
+            self.metrics.count('bytes_hashed', st.st_size, comp_name)
+            if self.blob_store: self.blob_store.add(sha1, full_path)
+
+    def open_download_engine(self, num_workers):
+        with self.engine_lock:
+            if self.engine is None:
+                self.engine = create_download_engine(self, self.config.get('advanced_settings', {}), DOWNLOAD_WORKER_MAX if self.download_limit else num_workers)
+                if self.download_limit: self.engine.scheduler.resize(self.download_limit.limit)
+            return self.engine
+
+    def close_download_engine(self):
+        with self.engine_lock:
+            if self.engine is not None: self.engine.close(); self.engine = None
+
+    def queue_download(self, item):
+        if self.cancellation_event.is_set():
+            future = Future(); future.cancel()
+            return future
+        # Files the blob store holds are registered as 'place' work up front, so placing them never grows a phase file by file.
+        item['phase'] = 'place' if self.blob_store and item.get('sha') and self.blob_store.has(item['sha']) else 'download'
+        self.progress.add_work(item['phase'], files=1, size=item.get('size'))
+        return self.open_download_engine(self.config.get('advanced_settings', {}).get('download_workers', 8)).submit(item)
+
+    def download_item(self, url, target_dir, path, sha, size, comp_name):
+        return {'url': url, 'dest': os.path.join(target_dir, path), 'size': size, 'sha': sha, 'root': store_root(target_dir), 'path': path, 'component': comp_name}
+
+    def component_failed(self, comp_name):
+        return any(f['component'] == comp_name for f in self.failures)
+
     def download_files_in_parallel(self, files, num_workers):
-        if not files: self.send_progress(None, 1, 1); return
+        if not files: return
         self.send_progress(f"Downloading {len(files)} new or updated files...", 0, len(files))
-        with ThreadPoolExecutor(max_workers=num_workers) as ex:
-            future_map = {ex.submit(self.download_file, f['url'], f['dest']): f for f in files}
-            for i, _ in enumerate(future_map):
-                if self.cancellation_event.is_set(): break; self.send_progress(None, i + 1, len(files))
+        get_session(files[0]['url'], num_workers)
+        owns_engine = self.engine is None
+        try:
+            self.open_download_engine(num_workers)
+            self.wait_downloads([self.queue_download(f) for f in files if not self.cancellation_event.is_set()])
+        finally:
+            if owns_engine: self.close_download_engine()
 
-    def download_file(self, url, dest_path):
+    def download_file(self, item):
         if self.cancellation_event.is_set(): return
         try:
-            os.makedirs(os.path.dirname(dest_path), exist_ok=True)
-            with requests.get(url, stream=True, verify=VERIFY_SSL, timeout=30) as r:
-                r.raise_for_status()
-                with open(dest_path, 'wb') as f:
-                    for chunk in r.iter_content(chunk_size=8192):
-                        if self.cancellation_event.is_set(): return
-                        f.write(chunk)
-            sha1 = calculate_sha1(dest_path)
-            if sha1: self.hash_cache[dest_path] = {'mtime': os.path.getmtime(dest_path), 'sha': sha1}
-        except Exception: pass
-
-    def update_component(self, repo_url, target_dir, scan_workers, dl_workers, comp_name, repo_subfolder_filter=None):
-        self.send_progress(f"Fetching {comp_name} file list from server...")
-
-        remote_files = get_remote_tree_fast(repo_url, self.cancellation_event)
-        if remote_files is None:
-            self.send_progress(f"ERROR: Failed to get {comp_name} file list. Check log.log for details.")
-            return
-        if self.cancellation_event.is_set(): return
-
-        local_files = self.get_local_file_hashes(target_dir, scan_workers)
+            if self.prepare_download(item): return
+            with self.connection_slot():
+                sha1 = self.fetch_with_resume(item)
+                if self.restart_stale_part(item, sha1): sha1 = self.fetch_with_resume(item)
+            if sha1 is None: return  # Cancelled; the .part file is kept so the next run can resume it.
+            self.finish_download(item, sha1)
+        except Exception as e:
+            # A transfer cut off by the cancel is not a failure; its .part file is kept for the next run.
+            if not self.cancellation_event.is_set(): self.record_failure(item, e)
+
+    def fetch_with_resume(self, item):
+        for attempt in range(RESUME_ATTEMPTS):
+            try:
+                return self.fetch_to_part(item)
+            except (requests.exceptions.ConnectionError, requests.exceptions.ChunkedEncodingError) as e:
+                if attempt == RESUME_ATTEMPTS - 1 or self.cancellation_event.is_set(): raise
+                self.metrics.count('retries', component=item.get('component'))
+                log.warning(f"Transfer of {item['url']} interrupted ({e}), resuming from the staged bytes.")
+
+    def restart_stale_part(self, item, sha1):
+        # A .part an earlier run left behind may hold the start of an older version of the file, so resuming it yields the wrong hash.
+        # Returns True after dropping such a part, for the caller to fetch the file once more from the first byte.
+        if not item.pop('resumed', False) or sha1 is None or not item.get('sha') or sha1 == item['sha']: return False
+        log.warning(f"Resumed download of {item['url']} does not match the tree (the file changed since it was staged), starting over.")
+        os.remove(item['dest'] + PART_SUFFIX)
+        return True
+
+    def prepare_download(self, item):
+        # Returns True when the file could be placed from the blob store and needs no transfer.
+        os.makedirs(os.path.dirname(item['dest']), exist_ok=True)
+        if self.blob_store and item.get('sha') and self.blob_store.place(item['sha'], item['dest'], PART_SUFFIX):
+            st = os.stat(item['dest'])
+            self.hash_store.put_stat(item['root'], item['path'], st, item['sha'])
+            # Nothing crossed the network, so download rates, totals and the tuner's throughput leave local copies out.
+            self.progress.advance('place', files=1, size=st.st_size)
+            self.metrics.count('files_placed', component=item.get('component'))
+            self.metrics.count('bytes_placed', st.st_size, item.get('component'))
+            return True
+        if item.get('phase') == 'place':
+            # The stored object failed its check and was dropped, so the file is downloaded after all.
+            item['phase'] = 'download'
+            self.progress.add_work('place', files=-1, size=-(item.get('size') or 0))
+            self.progress.add_work('download', files=1, size=item.get('size'))
+        return False
+
+    def count_download_bytes(self, item, done):
+        # Moves this file's share of the byte counter to `done`, so resumed or restarted transfers are never counted twice.
+        delta = done - item.get('bytes_counted', 0)
+        item['bytes_counted'] = done
+        if delta:
+            self.metrics.count('bytes_downloaded', delta, item.get('component'))
+            self.progress.advance('download', size=delta)
+
+    def finish_download(self, item, sha1):
+        self.commit_file(item, sha1)
+        self.metrics.count('files_downloaded', component=item.get('component'))
+        self.progress.advance('download', files=1)
+
+    def commit_file(self, item, sha1):
+        # Moves a verified .part file into place and records its hash.
+        dest_path = item['dest']
+        part_path = dest_path + PART_SUFFIX
+        if item.get('sha') and sha1 != item['sha']:
+            os.remove(part_path)
+            raise RuntimeError(f"Hash mismatch after download: expected {item['sha']}, got {sha1}")
+        os.replace(part_path, dest_path)
+        self.hash_store.put_stat(item['root'], item['path'], os.stat(dest_path), sha1)
+        if self.blob_store: self.blob_store.add(sha1, dest_path)
+
+    def record_failure(self, item, error):
+        log.error(f"Download failed for {item['url']}: {error}")
+        self.progress.advance(item.get('phase', 'download'), failed=1)
+        self.metrics.count('failures', component=item.get('component'))
+        self.failures.append({'path': item['path'], 'error': str(error), 'component': item.get('component')})
+
+    def fetch_to_part(self, item):
+        # Continues from whatever an earlier, interrupted attempt staged in the .part file. Returns the blob hash or None if cancelled.
+        url, part_path, size = item['url'], item['dest'] + PART_SUFFIX, item.get('size')
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        if size is not None and offset > size: offset = 0
+        if size is not None and offset == size:
+            self.count_download_bytes(item, size)
+            item['resumed'] = True
+            return calculate_blob_sha1(part_path)
+
+        headers = {'Range': f'bytes={offset}-'} if offset else {}
+        with get_session(url).get(url, stream=True, headers=headers, verify=VERIFY_SSL, timeout=30) as r, tracked(r):
+            self.metrics.count('retries', retry_count(r), item.get('component'))
+            # A request answered only after the cancel must not truncate what an earlier run staged.
+            if self.cancellation_event.is_set(): return None
+            if r.status_code == 416: os.remove(part_path)
+            r.raise_for_status()
+            if offset and (r.status_code != 206 or not r.headers.get('Content-Range', '').startswith(f'bytes {offset}-')):
+                log.debug(f"Server ignored the range request for {url}, starting over."); offset = 0
+            item['resumed'] = offset > 0
+            # Hash while the bytes arrive; the blob header needs the size up front, so use the tree size or Content-Length.
+            if size is None and r.headers.get('Content-Length', '').isdigit(): size = offset + int(r.headers['Content-Length'])
+            hasher, received = (git_blob_hasher(size) if size is not None else None), offset
+            self.count_download_bytes(item, offset)
+            with open(part_path, 'r+b' if offset else 'wb') as f:
+                if hasher: hash_file_prefix(f, hasher, offset)
+                f.seek(offset); f.truncate()
+                for chunk in r.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                    if self.cancellation_event.is_set(): return None
+                    if self.bandwidth: self.bandwidth.consume(len(chunk))
+                    f.write(chunk)
+                    received += len(chunk)
+                    self.count_download_bytes(item, received)
+                    if hasher: hasher.update(chunk)
+        return hasher.hexdigest() if hasher and received == size else calculate_blob_sha1(part_path)
+
+    def report_summary(self):
+        totals = self.progress.totals('download')
+        if not totals['files_done']: return
+        rate = totals['bytes_done'] / max(totals['elapsed'], 1e-3)
+        self.send_progress(f"Downloaded {totals['files_done']} files ({format_bytes(totals['bytes_done'])}) in {format_duration(totals['elapsed'])}, {format_bytes(rate)}/s on average.")
+
+    def report_failures(self):
+        if not self.failures: return
+        log.error(f"{len(self.failures)} files could not be downloaded: {[f['path'] for f in self.failures]}")
+        self.send_progress(f"WARNING: {len(self.failures)} files could not be downloaded and will be retried on the next update:")
+        for failure in self.failures[:MAX_REPORTED_FAILURES]: self.send_progress(f"  {failure['path']}: {failure['error']}")
+        if len(self.failures) > MAX_REPORTED_FAILURES: self.send_progress(f"  ... and {len(self.failures) - MAX_REPORTED_FAILURES} more, see log.log.")
+
+    def update_component(self, repo_url, target_dir, scan_workers, dl_workers, comp_name, repo_subfolder_filter=None, prune_dirs=()):
+        self.send_progress(f"Checking {comp_name} for updates...")
+        get_session(repo_url, dl_workers)
+        exclusions, root_key = self.config.get('exclusions', []), store_root(target_dir)
+        exclude = ExclusionMatcher(exclusions)
+        # The local scan needs nothing from the server, so it runs while the branch and tree are being fetched.
+        scanner = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f'{comp_name}-scan')
+        try:
+            scan_future = scanner.submit(self.get_local_file_hashes, target_dir, scan_workers, prune_dirs, comp_name, exclude)
+            with self.metrics.span('branch', comp_name): branch_info = self.call_cancellable(get_remote_branch, repo_url)
+            if self.cancellation_event.is_set(): return
+            if branch_info is None:
+                self.report_error(f"Failed to get {comp_name} file list. Check log.log for details.")
+                return
+
+            settings = json.dumps({'repo': branch_info['api_url'], 'subfolder': repo_subfolder_filter or '', 'exclusions': sorted(exclusions)}, sort_keys=True)
+            manifest = None if self.full_scan else self.hash_store.load_manifest(root_key, comp_name)
+            if manifest and manifest[0] == branch_info['commit'] and manifest[1] == settings:
+                self.verify_component(branch_info, manifest[2], scan_future, target_dir, comp_name, prune_dirs)
+                return
+
+            self.send_progress(f"Fetching {comp_name} file list from server...")
+            with self.metrics.span('tree', comp_name):
+                remote_files = self.call_cancellable(get_remote_tree_fast, repo_url, self.cancellation_event, branch_info, repo_subfolder_filter)
+            if self.cancellation_event.is_set(): return
+            if remote_files is None:
+                self.report_error(f"Failed to get {comp_name} file list. Check log.log for details.")
+                return
+
+            expected = {path: data for path, data in remote_files.items() if not exclude.matches(path)}
+            # The archive always holds the whole repository, so for one subfolder of it (the sounds repo ships every format) it would fetch far more than the wanted files.
+            use_archive = not repo_subfolder_filter
+            # A mostly missing tree will come from the archive, so no single downloads are started for it while the scan runs.
+            queued = {} if use_archive and self.mostly_missing(expected, target_dir) else self.queue_missing_during_scan(
+                scan_future, target_dir, comp_name, ((path, data['url'], data['sha'], data.get('size')) for path, data in expected.items()))
+            local_files = scan_future.result()
+        finally:
+            scanner.shutdown(wait=True)
         if self.cancellation_event.is_set(): return
 
         self.send_progress(f"Comparing {comp_name} files...")
-        files_to_dl, exclusions = [], self.config.get('exclusions', [])
-
-        for path_from_repo, data in remote_files.items():
-            if repo_subfolder_filter and not path_from_repo.startswith(repo_subfolder_filter + '/'): continue
-            if is_excluded(path_from_repo, exclusions): continue
-
-            if path_from_repo not in local_files or local_files[path_from_repo] != data['sha']:
-                files_to_dl.append({'url': data['url'], 'dest': os.path.join(target_dir, path_from_repo)})
-
+        with self.metrics.span('compare', comp_name):
+            files_to_dl = [self.download_item(data['url'], target_dir, path, data['sha'], data.get('size'), comp_name) for path, data in expected.items()
+                           if path not in queued and self.local_sha(local_files, target_dir, path, prune_dirs) != data['sha']]
+        if use_archive and not queued:
+            # Files the blob store already holds are placed locally either way; the archive decision is about the rest.
+            from_store = [item for item in files_to_dl if self.blob_store and self.blob_store.has(item['sha'])]
+            to_fetch = [item for item in files_to_dl if not (self.blob_store and self.blob_store.has(item['sha']))]
+            if self.wants_archive([item.get('size') for item in to_fetch], len(expected)):
+                files_to_dl = from_store + self.install_from_archive(branch_info, to_fetch, comp_name)
+        if files_to_dl: self.send_progress(f"Downloading {len(files_to_dl)} new or updated {comp_name} files...")
+        with self.metrics.span('download', comp_name): self.wait_downloads(list(queued.values()) + [self.queue_download(item) for item in files_to_dl])
+
+        if not self.cancellation_event.is_set() and not self.component_failed(comp_name):
+            self.hash_store.save_manifest(root_key, comp_name, branch_info['commit'], settings,
+                                          {path: (data['sha'], data.get('size')) for path, data in expected.items()})
+        else:
+            self.hash_store.drop_manifest(root_key, comp_name)
+
+    def archive_threshold(self):
+        return self.config.get('advanced_settings', {}).get('archive_threshold', ARCHIVE_THRESHOLD)
+
+    def wants_archive(self, sizes, total):
+        # `sizes` are the tree sizes of the files that need fetching, `total` the component's file count.
+        threshold = self.archive_threshold()
+        if not threshold or len(sizes) < ARCHIVE_MIN_FILES or len(sizes) < threshold * total: return False
+        return sum(size or 0 for size in sizes) / len(sizes) <= ARCHIVE_MAX_AVERAGE_SIZE
+
+    def mostly_missing(self, expected, target_dir):
+        if not self.archive_threshold() or len(expected) < ARCHIVE_MIN_FILES: return False
+        is_missing = missing_file_checker()
+        return self.wants_archive([data.get('size') for path, data in expected.items() if is_missing(os.path.join(target_dir, path))], len(expected))
+
+    def install_from_archive(self, branch_info, items, comp_name):
+        """Streams the repository archive of the resolved commit and extracts just `items` from it.
+
+        Every file is hashed as it is written and verified against the tree like a normal download.
+        Returns the items the archive did not deliver, for the caller to fetch one by one.
+        """
+        wanted = {item['path']: item for item in items}
+        url = f"{branch_info['api_url']}/archive/{branch_info['commit']}.tar.gz"
+        self.send_progress(f"Downloading {len(items)} {comp_name} files as a single archive...")
+        self.progress.add_work('archive', files=len(items), size=sum(item.get('size') or 0 for item in items))
+        try:
+            with self.metrics.span('archive', comp_name), self.connection_slot(), \
+                    get_session(url).get(url, stream=True, verify=VERIFY_SSL, timeout=30) as r, tracked(r):
+                r.raise_for_status()
+                with tarfile.open(fileobj=r.raw, mode='r|gz') as archive:
+                    for member in archive:
+                        if self.cancellation_event.is_set(): break
+                        # Gitea puts everything below a folder named after the repository.
+                        path = member.name.partition('/')[2]
+                        item = wanted.get(path) if member.isfile() else None
+                        if item is None: continue
+                        try: self.extract_member(archive, member, item)
+                        except (OSError, RuntimeError) as e:
+                            log.warning(f"Could not extract {path} from the {comp_name} archive: {e}"); continue
+                        del wanted[path]
+        except (requests.exceptions.RequestException, urllib3.exceptions.HTTPError, tarfile.TarError, EOFError, zlib.error, OSError) as e:
+            if self.cancellation_event.is_set(): return list(wanted.values())
+            log.warning(f"The {comp_name} archive download failed ({e}), fetching the remaining files one by one.")
+        if wanted:
+            log.info(f"{len(wanted)} {comp_name} files did not come from the archive.")
+            self.progress.advance('archive', failed=len(wanted))
+        return list(wanted.values())
+
+    def extract_member(self, archive, member, item):
+        os.makedirs(os.path.dirname(item['dest']), exist_ok=True)
+        source, hasher = archive.extractfile(member), git_blob_hasher(member.size)
+        with open(item['dest'] + PART_SUFFIX, 'wb') as f:
+            for chunk in iter(lambda: source.read(ARCHIVE_CHUNK_SIZE), b''):
+                if self.bandwidth: self.bandwidth.consume(len(chunk))
+                f.write(chunk)
+                hasher.update(chunk)
+                self.progress.advance('archive', size=len(chunk))
+        self.commit_file(item, hasher.hexdigest())
+        self.metrics.count('files_extracted', component=item.get('component'))
+        self.metrics.count('bytes_extracted', member.size, item.get('component'))
+        self.progress.advance('archive', files=1)
+
+    def verify_component(self, branch_info, expected, scan_future, target_dir, comp_name, prune_dirs=()):
+        # Same commit and settings as the last successful sync: no tree download, just make sure nothing local went missing or changed.
+        log.info(f"{comp_name} is already at commit {branch_info['commit']}, running a local integrity check.")
+        queued = self.queue_missing_during_scan(scan_future, target_dir, comp_name,
+                                                ((path, f"{branch_info['download_base']}/{path}", sha, size) for path, (sha, size) in expected.items()))
+        local_files = scan_future.result()
         if self.cancellation_event.is_set(): return
-        self.download_files_in_parallel(files_to_dl, dl_workers)
+        with self.metrics.span('compare', comp_name):
+            files_to_dl = [self.download_item(f"{branch_info['download_base']}/{path}", target_dir, path, sha, size, comp_name)
+                           for path, (sha, size) in expected.items() if path not in queued and self.local_sha(local_files, target_dir, path, prune_dirs) != sha]
+        if not files_to_dl and not queued:
+            self.send_progress(f"{comp_name.capitalize()} are already up to date."); return
+        if files_to_dl: self.send_progress(f"Restoring {len(files_to_dl)} missing or modified {comp_name} files...")
+        with self.metrics.span('download', comp_name): self.wait_downloads(list(queued.values()) + [self.queue_download(item) for item in files_to_dl])
+        if self.cancellation_event.is_set() or self.component_failed(comp_name): self.hash_store.drop_manifest(store_root(target_dir), comp_name)
+
+    def queue_missing_during_scan(self, scan_future, target_dir, comp_name, entries):
+        # A file that does not exist needs no hash to know it must be fetched, so start on those while the scan runs.
+        queued = {}
+        if scan_future.done(): return queued
+        is_missing = missing_file_checker()
+        for path, url, sha, size in entries:
+            if self.cancellation_event.is_set(): break
+            if is_missing(os.path.join(target_dir, path)): queued[path] = self.queue_download(self.download_item(url, target_dir, path, sha, size, comp_name))
+        if queued: self.send_progress(f"Downloading {len(queued)} missing {comp_name} files while the local scan finishes...")
+        return queued
+
+    def local_sha(self, local_files, target_dir, path, prune_dirs):
+        # Pruned folders belong to another component; the rare repo file inside one is hashed on demand.
+        if path in local_files or not any(path.startswith(d + '/') for d in prune_dirs): return local_files.get(path)
+        full_path = os.path.join(target_dir, path)
+        return calculate_blob_sha1(full_path) if os.path.isfile(full_path) else None
+
+    def get_components(self, base_path):
+        scripts_target_dir = os.path.join(base_path, self.config.get('scripts_target_subdir', ''))
+        scripts_repo_url = self.config.get('scripts_repo_url')
+
+        # --- THIS IS THE FIX ---
+        # Correctly use 'sounds_target_subdir' for the sounds component.
+        sounds_target_dir = os.path.join(base_path, self.config.get('sounds_target_subdir', ''))
+        sounds_repo_url, sounds_subfolder = self.config.get('sounds_repo_url'), self.config.get('sounds_subfolder')
+        log.debug(f"Sounds component target directory calculated as: {sounds_target_dir}")
+
+        components = []
+        if scripts_repo_url:
+            # The sounds component owns its subfolder; walking it again from the scripts root would only re-hash sound files.
+            prune = ()
+            if sounds_repo_url:
+                try: sounds_rel = os.path.relpath(os.path.join(sounds_target_dir, sounds_subfolder or ''), scripts_target_dir).replace('\\', '/')
+                except ValueError: sounds_rel = '..'
+                if sounds_rel != '.' and not sounds_rel.startswith('..'): prune = (sounds_rel,)
+            components.append({'name': 'scripts', 'repo_url': scripts_repo_url, 'target_dir': scripts_target_dir, 'subfolder': None, 'prune': prune})
+        else: log.warning("Skipping scripts: 'scripts_repo_url' not defined.")
+        if sounds_repo_url:
+            components.append({'name': 'sounds', 'repo_url': sounds_repo_url, 'target_dir': sounds_target_dir, 'subfolder': sounds_subfolder, 'prune': ()})
+        else: log.warning("Skipping sounds: 'sounds_repo_url' not defined.")
+        return components
+
+    def run_status(self):
+        return 'cancelled' if self.cancellation_event.is_set() else 'error' if self.errors else 'failed' if self.failures else 'ok'
 
     def run_update_or_install(self):
+        finished = threading.Event()
+        threading.Thread(target=self.watch_run, args=(finished,), name='run-watch', daemon=True).start()
         try:
             adv_settings, base_path = self.config.get("advanced_settings", {}), self.config.get('soundpack_path', '')
             scan_workers, dl_workers = adv_settings.get("scan_workers", 4), adv_settings.get("download_workers", 8)
 
-            if not base_path: self.send_progress("ERROR: Soundpack path is not set."); return
-
-            log.info("--- Preparing to update SCRIPTS component ---")
-            scripts_target_dir = os.path.join(base_path, self.config.get('scripts_target_subdir', ''))
-            scripts_repo_url = self.config.get('scripts_repo_url')
-            if scripts_repo_url: self.update_component(scripts_repo_url, scripts_target_dir, scan_workers, dl_workers, "scripts")
-            else: log.warning("Skipping scripts: 'scripts_repo_url' not defined.")
-            if self.cancellation_event.is_set(): return
-
-            log.info("--- Preparing to update SOUNDS component ---")
-
-            # --- THIS IS THE FIX ---
-            # Correctly use 'sounds_target_subdir' for the sounds component.
-            sounds_target_dir = os.path.join(base_path, self.config.get('sounds_target_subdir', ''))
-            sounds_repo_url = self.config.get('sounds_repo_url')
-
-            log.debug(f"Sounds component target directory calculated as: {sounds_target_dir}")
-
-            if sounds_repo_url:
-                self.update_component(
-                    sounds_repo_url,
-                    sounds_target_dir,
-                    scan_workers,
-                    dl_workers,
-                    "sounds",
-                    self.config.get('sounds_subfolder')
-                )
-            else: log.warning("Skipping sounds: 'sounds_repo_url' not defined.")
-            if self.cancellation_event.is_set(): return
+            if not base_path: self.report_error("Soundpack path is not set."); return
+            if adv_settings.get('auto_tune'):
+                self.start_tuning(scan_workers, dl_workers)
+                dl_workers = DOWNLOAD_WORKER_MAX  # Pools and engine threads are sized for the most the tuner may allow.
+
+            components = self.get_components(base_path)
+            self.open_download_engine(dl_workers)
+            # Components run side by side and feed one shared download engine, so sounds never wait for the scripts to finish.
+            with ThreadPoolExecutor(max_workers=max(len(components), 1), thread_name_prefix='component') as ex:
+                futures = []
+                for c in components:
+                    log.info(f"--- Preparing to update {c['name'].upper()} component ---")
+                    futures.append(ex.submit(self.update_component, c['repo_url'], c['target_dir'], scan_workers, dl_workers, c['name'], c['subfolder'], c['prune']))
+                for future in futures: future.result()
 
         except Exception as e:
             log.critical(f"A FATAL UNHANDLED ERROR occurred in the main update process: {e}", exc_info=True)
+            self.errors.append(str(e))
             self.send_progress(f"FATAL ERROR: {e}. Check log.log for details.")
 
         finally:
-            self.save_hash_cache()
+            finished.set()
+            self.close_download_engine()
+            if self.owns_hash_store: self.hash_store.close()
+            else: self.hash_store.commit()
+            cancel_seconds = round(time.monotonic() - self.cancelled_at, 3) if self.cancelled_at is not None else None
+            self.metrics.write(client=self.config.get('name'), status=self.run_status(), full_scan=self.full_scan,
+                               engine=self.config.get('advanced_settings', {}).get('download_engine', 'threads'), cancel_seconds=cancel_seconds,
+                               workers={tuner.name: tuner.level for tuner in self.tuners} or None)
+            self.report_summary()
+            self.report_failures()
             if not self.cancellation_event.is_set():
                 self.send_progress("Process finished.")
             else:
-                self.send_progress("Process cancelled.")
\ No newline at end of file
+                log.info(f"Run cancelled, stopped {cancel_seconds or 0:.2f}s after the request.")
+                # send_progress() goes quiet once cancelled, so this last line is delivered directly.
+                if self.progress_callback: self.progress_callback({'message': f"Process cancelled (stopped in {cancel_seconds or 0:.1f}s).", 'value': None, 'total': None})
\ No newline at end of file
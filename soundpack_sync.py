@@ -0,0 +1,99 @@
+import sys
+import json
+import time
+import signal
+import argparse
+import threading
+import config_manager
+from hash_store import HashStore
+from http_client import ConnectionLimiter
+from soundpack_manager import SoundpackManager
+from logger import log
+
+EXIT_OK = 0
+EXIT_DOWNLOAD_FAILURES = 1
+EXIT_ERROR = 2
+EXIT_CANCELLED = 130
+DEFAULT_MAX_CONNECTIONS = 16
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Sync one or more soundpack clients from configs.json without the GUI.")
+    parser.add_argument('clients', nargs='*', help="Client names to sync (default: every client with a soundpack path).")
+    parser.add_argument('--config', default=config_manager.CONFIG_FILE, help="Config file to read (default: %(default)s).")
+    parser.add_argument('--max-connections', type=int, default=DEFAULT_MAX_CONNECTIONS,
+                        help="Download connections shared by all clients (default: %(default)s).")
+    parser.add_argument('--full-scan', action='store_true', help="Verify every file like the Install button instead of a quick update.")
+    parser.add_argument('--quiet', action='store_true', help="Only print the JSON summary.")
+    return parser.parse_args(argv)
+
+def select_clients(configs, names):
+    clients = configs.get('clients', {})
+    if not names: return {name: c for name, c in clients.items() if c.get('soundpack_path')}, []
+    return {name: clients[name] for name in names if name in clients}, [name for name in names if name not in clients]
+
+def client_summary(name, manager, started, finished):
+    phases = manager.progress.summary()
+    download, archive, scan = phases.get('download', {}), phases.get('archive', {}), phases.get('scan', {})
+    return {
+        'client': name,
+        'status': manager.run_status(),
+        'files_checked': scan.get('files_done', 0),
+        'files_downloaded': download.get('files_done', 0) + archive.get('files_done', 0),
+        'files_placed': phases.get('place', {}).get('files_done', 0),
+        'files_failed': len(manager.failures),
+        'bytes_downloaded': download.get('bytes_done', 0) + archive.get('bytes_done', 0),
+        'errors': manager.errors,
+        'failures': manager.failures,
+        'cache_hit_rate': manager.metrics.snapshot()['cache_hit_rate'],
+        'durations': dict(manager.metrics.durations(), total=round(finished - started, 3)),
+    }
+
+def main(argv=None):
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    config_manager.CONFIG_FILE = args.config
+    clients, unknown = select_clients(config_manager.load_configs(), args.clients)
+    for name in unknown: print(f"Unknown client: {name}", file=sys.stderr)
+    if not clients:
+        print("No clients to sync.", file=sys.stderr); return EXIT_ERROR
+
+    cancellation_event = threading.Event()
+    hash_store, limiter = HashStore(), ConnectionLimiter(max(args.max_connections, 1))
+    managers, results, threads = {}, {}, []
+
+    def printer(name):
+        def progress(data):
+            if not args.quiet and data.get('message'): print(f"[{name}] {data['message']}", file=sys.stderr, flush=True)
+        return progress
+
+    def run(name, manager):
+        started = time.monotonic()
+        manager.run_update_or_install()
+        results[name] = client_summary(name, manager, started, time.monotonic())
+        tuned = manager.tuned_workers()
+        if tuned: config_manager.update_config_value(name, 'tuned_workers', tuned)
+
+    log.info(f"Headless sync starting for: {', '.join(clients)}")
+    previous_handler = signal.signal(signal.SIGINT, lambda *_: cancellation_event.set())
+    try:
+        for name, config in clients.items():
+            managers[name] = SoundpackManager(config, cancellation_event, printer(name), full_scan=args.full_scan,
+                                              hash_store=hash_store, connection_limiter=limiter)
+            threads.append(threading.Thread(target=run, args=(name, managers[name]), name=f"sync-{name}"))
+        for thread in threads: thread.start()
+        # join() with a timeout keeps the main thread responsive to Ctrl+C.
+        for thread in threads:
+            while thread.is_alive(): thread.join(0.2)
+    finally:
+        signal.signal(signal.SIGINT, previous_handler)
+        hash_store.close()
+
+    summary = {'clients': [results[name] for name in clients if name in results], 'unknown_clients': unknown}
+    print(json.dumps(summary, indent=2))
+    log.info("Headless sync finished.")
+    if cancellation_event.is_set(): return EXIT_CANCELLED
+    if unknown or any(r['status'] == 'error' for r in summary['clients']): return EXIT_ERROR
+    if any(r['status'] == 'failed' for r in summary['clients']): return EXIT_DOWNLOAD_FAILURES
+    return EXIT_OK
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,8 +1,9 @@
-import wx
-import gui
 from logger import log
 
 def main():
+    # wx is heavy and needs a display; nothing else in the updater imports it, so headless tools stay light.
+    import wx
+    import gui
     log.info("Application starting.")
     app = wx.App(False)
     frame = gui.MainFrame(None)
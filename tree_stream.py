@@ -0,0 +1,66 @@
+import json
+import codecs
+
+_decoder = json.JSONDecoder()
+_WHITESPACE = ' \t\n\r'
+
+class _Reader:
+    # A sliding window over the decoded response; text before `pos` is dropped whenever more is read.
+    def __init__(self, chunks):
+        self.chunks, self.decoder = iter(chunks), codecs.getincrementaldecoder('utf-8')()
+        self.buf, self.pos, self.eof = '', 0, False
+
+    def fill(self):
+        if self.eof: raise ValueError("Tree response ended early.")
+        chunk = next(self.chunks, None)
+        if chunk is None: text, self.eof = self.decoder.decode(b'', final=True), True
+        else: text = self.decoder.decode(chunk)
+        self.buf, self.pos = self.buf[self.pos:] + text, 0
+
+    def peek(self):
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in _WHITESPACE: self.pos += 1
+            if self.pos < len(self.buf): return self.buf[self.pos]
+            self.fill()
+
+    def expect(self, chars):
+        char = self.peek()
+        if char not in chars: raise ValueError(f"Unexpected {char!r} in tree response, expected one of {chars!r}.")
+        self.pos += 1
+        return char
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.buf, self.pos)
+                # A number that ends exactly at the end of the buffer may continue in the next chunk.
+                if end < len(self.buf) or self.eof:
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof: raise
+            self.fill()
+
+def iter_tree_entries(chunks, meta):
+    """Yields the entries of a git/trees response one at a time while it is still downloading.
+
+    `chunks` is an iterable of bytes (e.g. response.iter_content()). Every other top-level field
+    ('sha', 'truncated', 'page', 'total_count', ...) is stored in `meta`, so only one entry is ever
+    held in memory instead of the whole decoded document.
+    """
+    reader = _Reader(chunks)
+    reader.expect('{')
+    if reader.peek() == '}': return
+    while True:
+        key = reader.value()
+        reader.expect(':')
+        if key == 'tree' and reader.peek() == '[':
+            reader.expect('[')
+            if reader.peek() == ']': reader.expect(']')
+            else:
+                while True:
+                    yield reader.value()
+                    if reader.expect(',]') == ']': break
+        else: meta[key] = reader.value()
+        if reader.expect(',}') == '}': return